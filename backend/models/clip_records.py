@@ -0,0 +1,127 @@
+"""Recorded stdet model inputs for offline validation and calibration."""
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class ClipRecorder:
+    """Save the stdet model inputs of clips with people as `.npz` files.
+
+    Each compressed file holds the sampled uint8 `frames` of the clip with
+    the parameters of its normalizer, the `proposals` and the `img_shape` of
+    `TaskInfo.get_model_inputs`. `load_records` normalizes the frames the
+    same way, so offline tools replay exactly what the models saw on a real
+    stream, at a fraction of the size of the float clip. The display
+    `keyframe` the human detector ran on is saved too, see `load_keyframes`.
+
+    Args:
+        out_dir (str): Directory to write records to.
+        max_clips (int): Stop recording after this many clips, <= 0 means
+            unbounded. Default: 100.
+    """
+
+    def __init__(self, out_dir, max_clips=100):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.max_clips = max_clips
+        self.num_clips = 0
+        self.lock = threading.Lock()
+
+    def record(self, task):
+        """Save the model inputs of a task, return the task."""
+        if len(task.stdet_bboxes) == 0:
+            return task
+        with self.lock:
+            if 0 < self.max_clips <= self.num_clips:
+                return task
+            self.num_clips += 1
+
+        normalizer = task.normalizer
+        area = "clip" if task.area_id is None else f"area{task.area_id}"
+        np.savez_compressed(
+            os.path.join(self.out_dir, f"{area}_{task.id:06d}.npz"),
+            frames=np.stack([task.processed_frames[i] for i in task.frames_inds]),
+            mean=normalizer.mean.ravel(),
+            stdinv=normalizer.stdinv.ravel(),
+            to_rgb=np.array(normalizer.to_rgb),
+            proposals=task.stdet_bboxes.cpu().numpy().astype(normalizer.dtype),
+            keyframe=task.frames[len(task.frames) // 2],
+            img_shape=np.array(task.img_shape),
+        )
+        return task
+
+
+def _normalize(record):
+    """Normalize recorded (t, h, w, c) frames like `ClipNormalizer`."""
+    frames, mean, stdinv = record["frames"], record["mean"], record["stdinv"]
+    if record["to_rgb"]:
+        frames = frames[..., ::-1]
+    img = np.empty((1, frames.shape[3]) + frames.shape[:3], dtype=mean.dtype)
+    np.subtract(
+        frames.transpose((3, 0, 1, 2)),
+        mean[:, np.newaxis, np.newaxis, np.newaxis],
+        out=img[0],
+        casting="unsafe",
+    )
+    np.multiply(img[0], stdinv[:, np.newaxis, np.newaxis, np.newaxis], out=img[0])
+    return img
+
+
+def _record_files(record_dir, max_clips):
+    files = sorted(file for file in os.listdir(record_dir) if file.endswith(".npz"))
+    if max_clips > 0:
+        files = files[:max_clips]
+    if not files:
+        logger.warning(f"No recorded clips in {record_dir}")
+    return files
+
+
+def load_records(record_dir, device="cpu", max_clips=0):
+    """Yield recorded clips as stdet model inputs, in file name order.
+
+    Args:
+        record_dir (str): Directory written by `ClipRecorder`.
+        device (str): Device of the returned tensors. Default: 'cpu'.
+        max_clips (int): Max number of clips, <= 0 means all. Default: 0.
+
+    Yields:
+        tuple: File name and model inputs like `TaskInfo.get_model_inputs`.
+    """
+    for file in _record_files(record_dir, max_clips):
+        with np.load(os.path.join(record_dir, file)) as record:
+            # records of older versions hold the normalized clip
+            img = record["img"] if "img" in record else _normalize(record)
+            img = torch.from_numpy(img).to(device)
+            proposals = torch.from_numpy(record["proposals"]).to(device)
+            img_shape = tuple(record["img_shape"].tolist())
+        yield file, dict(
+            return_loss=False,
+            img=[img],
+            proposals=[[proposals]],
+            img_metas=[[dict(img_shape=img_shape)]],
+        )
+
+
+def load_keyframes(record_dir, max_clips=0):
+    """Yield the display keyframes the human detector saw, in file name order.
+
+    Records of older versions have no keyframe and are skipped.
+
+    Args:
+        record_dir (str): Directory written by `ClipRecorder`.
+        max_clips (int): Max number of clips, <= 0 means all. Default: 0.
+
+    Yields:
+        tuple: File name and the uint8 "BGR" keyframe.
+    """
+    for file in _record_files(record_dir, max_clips):
+        with np.load(os.path.join(record_dir, file)) as record:
+            if "keyframe" not in record:
+                continue
+            keyframe = record["keyframe"]
+        yield file, keyframe
@@ -0,0 +1,163 @@
+"""Benchmark of the stdet ensemble thread pool against sequential members.
+
+Times `EnsemblePredictor.predict` on the same clips, recorded with
+`--record-clips`, twice: once with members running concurrently on the
+predictor's thread pool, each with its own intra-op thread budget, and
+once with members called one after the other in the calling thread,
+which keeps every torch thread. Both runs are warmed up first, and the
+report gives the throughput of each in clips per second.
+
+Example:
+    python ensemble_benchmark.py --records demo/records --device cpu
+"""
+import argparse
+import logging
+import os
+import time
+
+from mmcv import Config, DictAction
+
+from clip_records import load_records
+from my_webcam_demo_stdet_ensemble import EnsemblePredictor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stdet ensemble benchmark")
+    parser.add_argument(
+        "--config",
+        default=("stdet_model/best_models/configs/"),
+        help="folder whose first config is shared by ensemble members",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=("stdet_model/best_models/checkpoints/"),
+        help="folder of ensemble member checkpoints",
+    )
+    parser.add_argument(
+        "--label-map", default="stdet_model/label_map.txt", help="label map file"
+    )
+    parser.add_argument(
+        "--records",
+        required=True,
+        help="folder of clips recorded with --record-clips",
+    )
+    parser.add_argument(
+        "--max-clips", default=16, type=int, help="max number of recorded clips"
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda:0", help="CPU/CUDA device option"
+    )
+    parser.add_argument(
+        "--repeat", default=3, type=int, help="number of passes over the clips"
+    )
+    parser.add_argument(
+        "--ensemble-workers",
+        default=0,
+        type=int,
+        help="number of members run at the same time, <= 0 runs all of them",
+    )
+    parser.add_argument(
+        "--threads-per-model",
+        default=0,
+        type=int,
+        help="intra-op CPU threads of each member, <= 0 splits the torch "
+        "threads evenly between concurrent members",
+    )
+    parser.add_argument(
+        "--action-score-thr",
+        type=float,
+        default=0.92,
+        help="the threshold of human action score",
+    )
+    parser.add_argument(
+        "--cfg-options",
+        nargs="+",
+        action=DictAction,
+        default={},
+        help="override some settings in the used config, the key-value pair "
+        "in xxx=yyy format will be merged into config file",
+    )
+    return parser.parse_args()
+
+
+class RecordedTask:
+    """The parts of `TaskInfo` the ensemble uses, for a recorded clip."""
+
+    def __init__(self, inputs):
+        # members run in float32, like the demo without --input-dtype
+        inputs["img"] = [inputs["img"][0].float()]
+        inputs["proposals"] = [[inputs["proposals"][0][0].float()]]
+        self.inputs = inputs
+        self.stdet_bboxes = inputs["proposals"][0][0]
+        self.action_preds = None
+
+    def get_model_inputs(self, device):
+        return self.inputs
+
+    def add_action_preds(self, preds):
+        self.action_preds = preds
+
+
+class SequentialPool:
+    """Stand-in for the ensemble thread pool which runs members in turn."""
+
+    def map(self, fn, items):
+        return [fn(item) for item in items]
+
+
+def run(predictor, tasks, repeat):
+    for task in tasks:  # warmup
+        predictor.predict(task)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for task in tasks:
+            predictor.predict(task)
+    return repeat * len(tasks) / (time.perf_counter() - start_time)
+
+
+def main(args):
+    # the predictor logs every clip
+    logging.getLogger("my_webcam_demo_stdet_ensemble").setLevel(logging.INFO)
+
+    configs = sorted(os.listdir(args.config))
+    config = Config.fromfile(os.path.join(args.config, configs[0]))
+    config.merge_from_dict(args.cfg_options)
+    try:
+        # different actions should have the same number of bboxes
+        config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
+    except KeyError:
+        pass
+
+    tasks = [
+        RecordedTask(inputs)
+        for _, inputs in load_records(args.records, args.device, args.max_clips)
+        if len(inputs["proposals"][0][0])
+    ]
+    assert tasks, f"No recorded clips with people in {args.records}"
+
+    predictor = EnsemblePredictor(
+        config=config,
+        checkpoints=args.checkpoint,
+        device=args.device,
+        score_thr=args.action_score_thr,
+        label_map_path=args.label_map,
+        num_workers=args.ensemble_workers,
+        threads_per_model=args.threads_per_model,
+    )
+    pool_fps = run(predictor, tasks, args.repeat)
+    pool, predictor.pool = predictor.pool, SequentialPool()
+    sequential_fps = run(predictor, tasks, args.repeat)
+    predictor.pool = pool
+    pool.shutdown()
+
+    print(
+        f"{len(predictor.members)} members, {len(tasks)} clips x {args.repeat} "
+        f"on {args.device}"
+    )
+    print(f"sequential members: {sequential_fps:.2f} clips/s")
+    print(f"thread pool:        {pool_fps:.2f} clips/s")
+    print(f"speedup:            {pool_fps / sequential_fps:.2f}x")
+
+
+if __name__ == "__main__":
+    main(parse_args())
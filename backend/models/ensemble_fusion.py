@@ -0,0 +1,46 @@
+"""Vectorized fusion of the action scores of ensemble members."""
+import numpy as np
+
+FUSION_METHODS = ("mean", "max", "weighted", "majority")
+
+
+def fuse_scores(scores, method="mean", weights=None, vote_thr=None):
+    """Fuse the scores of several models into one score per bbox and class.
+
+    Methods:
+
+    1) mean: average score of the models.
+    2) max: highest score of the models.
+    3) weighted: average score weighted by `weights`.
+    4) majority: the score exceeded by a strict majority of the models, so
+        it is above a threshold iff more than half of the models are.
+
+    Every method is non-decreasing in each model's score, so bounds of the
+    fused score follow from bounds of unknown model scores.
+
+    Args:
+        scores (ndarray): Scores with shape [num_models, num_bboxes,
+            num_classes].
+        method (str): One of `FUSION_METHODS`. Default: 'mean'.
+        weights (ndarray, optional): Non-negative weight of each model, only
+            used by 'weighted'. Default: None.
+        vote_thr (float, optional): Scores not above this value count as 0,
+            so only confident models vote. Default: None.
+
+    Returns:
+        ndarray: Fused scores with shape [num_bboxes, num_classes], aligned
+            with the bboxes of the input.
+    """
+    if vote_thr is not None:
+        scores = np.where(scores > vote_thr, scores, 0)
+    if method == "mean":
+        return scores.mean(axis=0)
+    if method == "max":
+        return scores.max(axis=0)
+    if method == "weighted":
+        weights = np.asarray(weights, dtype=scores.dtype)
+        assert len(weights) == len(scores), "one weight per model is required"
+        return np.tensordot(weights / weights.sum(), scores, axes=1)
+    if method == "majority":
+        return np.sort(scores, axis=0)[(len(scores) - 1) // 2]
+    raise ValueError(f"Unknown fusion method {method}, choose from {FUSION_METHODS}")
@@ -0,0 +1,215 @@
+"""Preallocated frame storage shared by the read, main and display threads."""
+import threading
+
+import numpy as np
+import torch
+
+
+class FrameWindow:
+    """Index view of consecutive frames stored in a ring buffer.
+
+    Behaves like a read-only list of frames. Items are views into the ring
+    buffer storage, so creating a window never copies pixel data.
+
+    Args:
+        get_frame (callable): Return the frame of a sequence number.
+        start (int): Sequence number of the first frame in the window.
+        length (int): Number of frames in the window.
+        frame_shape (tuple[int]): Shape of one frame.
+    """
+
+    def __init__(self, get_frame, start, length, frame_shape):
+        self.get_frame = get_frame
+        self.start = start
+        self.length = length
+        self.frame_shape = frame_shape
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.length))]
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError("frame index out of range")
+        return self.get_frame(self.start + idx)
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield self[idx]
+
+
+class FrameRingBuffer:
+    """Fixed-capacity ring buffer of display frames and processed frames.
+
+    Frames are addressed by a monotonically increasing sequence number and
+    each slot is reference counted. The read thread writes new frames in
+    place and holds one reference until the frame leaves its carry-over
+    buffer. Every task sharing a frame holds another one through
+    `acquire()`, and the display thread drops it with `release()` once the
+    task has been shown. The writer blocks while the next slot is still
+    referenced, so memory use stays flat no matter how far the main thread
+    falls behind, and overlapping windows never duplicate frames.
+
+    The writer only fills the parts of a slot that some consumer needs, so
+    the content of a display or processed frame which nobody reads is
+    undefined.
+
+    Args:
+        capacity (int): Max number of frames kept alive at the same time.
+        display_shape (tuple[int]): Shape of one display frame (h, w, c).
+        processed_shape (tuple[int]): Shape of one processed frame (h, w, c).
+        processed_dtype (np.dtype): Data type of processed frames.
+            Default: np.uint8.
+    """
+
+    def __init__(
+        self, capacity, display_shape, processed_shape, processed_dtype=np.uint8
+    ):
+        self.capacity = capacity
+        self.frames = np.empty((capacity, *display_shape), dtype=np.uint8)
+        self.processed_frames = np.empty(
+            (capacity, *processed_shape), dtype=processed_dtype
+        )
+        self.refcounts = np.zeros(capacity, dtype=np.int64)
+        self.head = 0  # sequence number of the next frame to write
+        self.closed = False
+        self.cond = threading.Condition()
+
+    @property
+    def nbytes(self):
+        """Memory taken by the preallocated frames."""
+        return self.frames.nbytes + self.processed_frames.nbytes
+
+    def wait_writable(self, timeout=0.1):
+        """Block until the slot for `self.head` is free.
+
+        Returns:
+            bool: False if the buffer has been closed while waiting.
+        """
+        with self.cond:
+            while self.refcounts[self.head % self.capacity] and not self.closed:
+                self.cond.wait(timeout)
+            return not self.closed
+
+    def next_slot(self):
+        """Return writable (display, processed) views for `self.head`."""
+        idx = self.head % self.capacity
+        return self.frames[idx], self.processed_frames[idx]
+
+    def commit(self):
+        """Publish the frame written into `next_slot()`.
+
+        The new frame starts with one reference owned by the writer.
+        """
+        with self.cond:
+            self.refcounts[self.head % self.capacity] = 1
+            self.head += 1
+
+    def display_frame(self, seq):
+        """Return the display frame with sequence number `seq`."""
+        return self.frames[seq % self.capacity]
+
+    def processed_frame(self, seq):
+        """Return the processed frame with sequence number `seq`."""
+        return self.processed_frames[seq % self.capacity]
+
+    def _slots(self, start, length):
+        return np.arange(start, start + length) % self.capacity
+
+    def acquire(self, start):
+        """Reference frames from `start` to `self.head` for a new task.
+
+        Returns:
+            tuple[FrameWindow]: display and processed views of the frames.
+        """
+        with self.cond:
+            length = self.head - start
+            self.refcounts[self._slots(start, length)] += 1
+        return (
+            FrameWindow(self.display_frame, start, length, self.frames.shape[1:]),
+            FrameWindow(
+                self.processed_frame,
+                start,
+                length,
+                self.processed_frames.shape[1:],
+            ),
+        )
+
+    def release(self, start, length):
+        """Drop one reference of `length` frames from sequence `start`."""
+        with self.cond:
+            self.refcounts[self._slots(start, length)] -= 1
+            self.cond.notify_all()
+
+    def close(self):
+        """Wake up and stop any writer waiting for free slots."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class ClipNormalizer:
+    """Normalize a clip of uint8 frames into a preallocated model input.
+
+    Sampled frames are written straight into a contiguous (1, c, t, h, w)
+    buffer, which is allocated once per stream and worker thread and exposed
+    as a torch tensor without copying. Non-CPU devices get one preallocated
+    device tensor that the buffer is copied into. Nothing is allocated per
+    clip, so callers must consume the returned tensor before their next
+    call.
+
+    Args:
+        clip_shape (tuple[int]): Shape of the clip (t, h, w, c).
+        mean (ndarray): Mean values of 3 channels.
+        std (ndarray): Std values of 3 channels.
+        to_rgb (bool): Whether to convert frames from BGR to RGB.
+        dtype (np.dtype): Data type of the output. Default: np.float32.
+    """
+
+    def __init__(self, clip_shape, mean, std, to_rgb, dtype=np.float32):
+        t, h, w, c = clip_shape
+        self.shape = (1, c, t, h, w)
+        self.dtype = dtype
+        self.local = threading.local()  # buffers of each worker thread
+        self.mean = np.asarray(mean, dtype=dtype)[:, np.newaxis, np.newaxis]
+        self.stdinv = (1 / np.asarray(std, dtype=dtype))[
+            :, np.newaxis, np.newaxis, np.newaxis
+        ]
+        self.to_rgb = to_rgb
+
+    def __call__(self, frames, device):
+        """Normalize a list of (h, w, c) uint8 frames.
+
+        Args:
+            frames (list[ndarray]): Frames of the clip in "BGR" format.
+            device (str | torch.device): Device of the returned tensor.
+
+        Returns:
+            torch.Tensor: Normalized clip with shape (1, c, t, h, w).
+        """
+        local = self.local
+        if not hasattr(local, "buffer"):
+            local.buffer = np.empty(self.shape, dtype=self.dtype)
+            local.tensor = torch.from_numpy(local.buffer)
+            local.device_tensors = {}
+
+        for idx, frame in enumerate(frames):
+            if self.to_rgb:
+                frame = frame[..., ::-1]
+            np.subtract(
+                frame.transpose((2, 0, 1)),
+                self.mean,
+                out=local.buffer[0, :, idx],
+                casting="unsafe",
+            )
+        np.multiply(local.buffer[0], self.stdinv, out=local.buffer[0])
+
+        device = torch.device(device)
+        if device.type == "cpu":
+            return local.tensor
+        if device not in local.device_tensors:
+            local.device_tensors[device] = torch.empty_like(local.tensor, device=device)
+        return local.device_tensors[device].copy_(local.tensor)
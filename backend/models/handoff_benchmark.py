@@ -0,0 +1,151 @@
+"""Micro-benchmark of the task handoff between the read, main and display threads.
+
+Compares the latency from the read of a clip to its display with the old
+handoff, where the main thread polled `qsize()` and the display thread
+polled its dict of tasks, both sleeping between polls, and the current
+one, where both threads block on `BoundedTaskQueue.get` and
+`ReorderBuffer.get` until a task arrives. Reading, inference and display
+are replaced by sleeps, so only the handoff differs between the runs.
+
+Example:
+    python handoff_benchmark.py --num-clips 200 --clip-interval 0.1
+"""
+import argparse
+import queue
+import threading
+import time
+
+import numpy as np
+
+from stream_utils import BoundedTaskQueue, ReorderBuffer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Thread handoff micro-benchmark")
+    parser.add_argument(
+        "--num-clips", default=100, type=int, help="number of clips per run"
+    )
+    parser.add_argument(
+        "--clip-interval",
+        default=0.1,
+        type=float,
+        help="seconds between two clips of the read thread",
+    )
+    parser.add_argument(
+        "--infer-ms",
+        default=30,
+        type=float,
+        help="simulated inference time of the main thread",
+    )
+    parser.add_argument(
+        "--display-ms",
+        default=5,
+        type=float,
+        help="simulated time to show a clip",
+    )
+    return parser.parse_args()
+
+
+def read_loop(args, put):
+    for idx in range(args.num_clips):
+        time.sleep(args.clip_interval)
+        put((idx, time.perf_counter()))
+
+
+def run_old(args):
+    """Sleep polling, like the demos before the blocking handoff."""
+    read_queue = queue.Queue()
+    display_queue = {}
+    display_lock = threading.Lock()
+    latencies = []
+
+    def main_loop():
+        for _ in range(args.num_clips):
+            task = None
+            while task is None:
+                if read_queue.qsize() == 0:
+                    time.sleep(0.02)  # ClipHelper.__next__
+                    time.sleep(0.01)  # main loop on an empty read
+                    continue
+                task = read_queue.get()
+            time.sleep(args.infer_ms / 1000)
+            with display_lock:
+                display_queue[task[0]] = task
+
+    def display_loop():
+        display_id = 0
+        while display_id < args.num_clips:
+            with display_lock:
+                task = display_queue.pop(display_id, None)
+            if task is None:
+                time.sleep(0.02)
+                continue
+            latencies.append(time.perf_counter() - task[1])
+            time.sleep(args.display_ms / 1000)
+            display_id += 1
+
+    return run_threads(args, read_queue.put, main_loop, display_loop, latencies)
+
+
+def run_new(args):
+    """Blocking handoff of the current demos."""
+    read_queue = BoundedTaskQueue()
+    display_queue = ReorderBuffer()
+    latencies = []
+
+    def main_loop():
+        for _ in range(args.num_clips):
+            while True:
+                try:
+                    task = read_queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            time.sleep(args.infer_ms / 1000)
+            display_queue.put(task[0], task)
+
+    def display_loop():
+        for _ in range(args.num_clips):
+            entry = None
+            while entry is None:
+                entry = display_queue.get(timeout=0.5)
+            latencies.append(time.perf_counter() - entry[1][1])
+            time.sleep(args.display_ms / 1000)
+
+    return run_threads(args, read_queue.put, main_loop, display_loop, latencies)
+
+
+def run_threads(args, put, main_loop, display_loop, latencies):
+    threads = [
+        threading.Thread(target=read_loop, args=(args, put)),
+        threading.Thread(target=main_loop),
+        threading.Thread(target=display_loop),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return 1000 * np.array(latencies)
+
+
+def report(name, latencies, infer_ms):
+    print(
+        f"{name}: mean {latencies.mean():.1f} ms, "
+        f"p50 {np.percentile(latencies, 50):.1f} ms, "
+        f"p95 {np.percentile(latencies, 95):.1f} ms, "
+        f"max {latencies.max():.1f} ms, "
+        f"handoff overhead {latencies.mean() - infer_ms:.1f} ms"
+    )
+
+
+def main(args):
+    print(
+        f"{args.num_clips} clips every {1000 * args.clip_interval:.0f} ms, "
+        f"inference {args.infer_ms:.0f} ms, read to display latency:"
+    )
+    report("old sleep polling", run_old(args), args.infer_ms)
+    report("blocking handoff ", run_new(args), args.infer_ms)
+
+
+if __name__ == "__main__":
+    main(parse_args())
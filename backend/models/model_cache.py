@@ -0,0 +1,113 @@
+"""Cached model loading for a fast demo startup."""
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+
+import torch
+from mmcv.runner import load_checkpoint
+
+from quantization import load_quantized
+
+logger = logging.getLogger(__name__)
+
+
+def _load_snapshot(path):
+    try:
+        # weights are mapped from the page cache instead of being read
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except TypeError:  # torch < 2.1 has no mmap loading
+        return torch.load(path, map_location="cpu")
+
+
+class ModelLoader:
+    """Load models with their checkpoint applied, through cached snapshots.
+
+    The first load of a model builds it, applies its checkpoint and saves
+    the whole CPU model to `cache_dir`. Later loads unpickle the snapshot,
+    memory-mapped when torch supports it, which skips building, weight init
+    and checkpoint key matching. Snapshots are keyed by the model config,
+    the checkpoint path, size and mtime, and the torch version, so a new
+    checkpoint or config builds a new snapshot. int8 models are always
+    built, quantized torch modules do not survive pickling intact.
+
+    Models without a snapshot that share a config, like ensemble members,
+    are built once and copied for every further checkpoint, until `clear`.
+
+    Args:
+        cache_dir (str, optional): Directory of snapshots. Default: None,
+            building every model.
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.templates = {}  # config digest -> model without weights
+
+    @staticmethod
+    def _digest(*parts):
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def load(self, model_cfg, checkpoint, build, quantized=False):
+        """Return a CPU model in eval mode with `checkpoint` applied.
+
+        Args:
+            model_cfg (dict): Config the model is built from.
+            checkpoint (str): Path to checkpoint.
+            build (callable): Build the model without weights from
+                `model_cfg`.
+            quantized (bool): Whether `checkpoint` is an int8 model saved by
+                `quantize.py`. Default: False.
+        """
+        start_time = time.time()
+        cfg_key = self._digest(model_cfg)
+        snapshot = None
+        if self.cache_dir and not quantized:
+            stat = os.stat(checkpoint)
+            key = self._digest(
+                cfg_key,
+                os.path.abspath(checkpoint),
+                stat.st_size,
+                stat.st_mtime,
+                torch.__version__,
+            )
+            name = os.path.splitext(os.path.basename(checkpoint))[0]
+            snapshot = os.path.join(self.cache_dir, f"{name}_{key}.pt")
+            if os.path.exists(snapshot):
+                try:
+                    model = _load_snapshot(snapshot)
+                    logger.info(
+                        f"Loaded {checkpoint} from snapshot in "
+                        f"{time.time() - start_time:.2f} s"
+                    )
+                    return model
+                except Exception as e:
+                    logger.warning(f"Rebuilding unreadable snapshot {snapshot}: {e}")
+
+        if cfg_key not in self.templates:
+            self.templates[cfg_key] = build()
+        model = copy.deepcopy(self.templates[cfg_key])
+        if quantized:
+            load_quantized(model, checkpoint)
+        else:
+            loaded = load_checkpoint(model, checkpoint, map_location="cpu")
+            meta = loaded.get("meta", {})
+            if "CLASSES" in meta:  # like `init_detector`
+                model.CLASSES = meta["CLASSES"]
+        model.eval()
+
+        if snapshot is not None:
+            # write then rename, so concurrent demos never read a partial file
+            tmp_file = f"{snapshot}.{os.getpid()}.tmp"
+            torch.save(model, tmp_file)
+            os.replace(tmp_file, snapshot)
+        logger.info(f"Built {checkpoint} in {time.time() - start_time:.2f} s")
+        return model
+
+    def clear(self):
+        """Release the models kept to build further checkpoints."""
+        self.templates.clear()
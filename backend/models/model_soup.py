@@ -0,0 +1,261 @@
+"""Build a weight-averaged "model soup" of the stdet ensemble.
+
+All ensemble members share one config, so their weights can be averaged
+into a single checkpoint that runs one forward pass per clip instead of
+one per member.
+
+1) uniform: average the weights of all members.
+2) greedy: add members in order of their agreement with the ensemble and
+    keep each one only if the soup gets closer to the ensemble.
+
+Both are validated on clips recorded with `--record-clips`. The report
+compares the action scores of every member and of the soup with the
+ensemble average, and checks alerts against the ensemble vote.
+
+Example:
+    python model_soup.py --records demo/records --method greedy \\
+        --out stdet_model/best_models/soup.pth
+    python my_webcam_demo_stdet_ensemble.py --soup stdet_model/best_models/soup.pth
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from mmcv import Config, DictAction
+
+from mmaction.models import build_detector
+
+from clip_records import load_records
+from ensemble_fusion import fuse_scores
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stdet ensemble model soup")
+    parser.add_argument(
+        "--config",
+        default=("stdet_model/best_models/configs/"),
+        help="config file, or folder whose first config is shared by members",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=("stdet_model/best_models/checkpoints/"),
+        help="folder of ensemble member checkpoints",
+    )
+    parser.add_argument(
+        "--method",
+        default="uniform",
+        choices=("uniform", "greedy"),
+        help="how members are averaged, greedy needs --records",
+    )
+    parser.add_argument(
+        "--records",
+        default=None,
+        help="folder of clips recorded with --record-clips, for greedy soups "
+        "and the validation report",
+    )
+    parser.add_argument(
+        "--max-clips", default=0, type=int, help="max number of recorded clips"
+    )
+    parser.add_argument(
+        "--out",
+        default="stdet_model/best_models/soup.pth",
+        help="output checkpoint",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="output json report, defaults to the checkpoint path with .json",
+    )
+    parser.add_argument(
+        "--label-map", default="stdet_model/label_map.txt", help="label map file"
+    )
+    parser.add_argument(
+        "--alert-label", default="drowning", help="label that raises alerts"
+    )
+    parser.add_argument(
+        "--action-score-thr",
+        type=float,
+        default=0.92,
+        help="the threshold of human action score",
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda:0", help="CPU/CUDA device option"
+    )
+    parser.add_argument(
+        "--cfg-options",
+        nargs="+",
+        action=DictAction,
+        default={},
+        help="override some settings in the used config, the key-value pair "
+        "in xxx=yyy format will be merged into config file",
+    )
+    return parser.parse_args()
+
+
+def load_state_dict(path):
+    checkpoint = torch.load(path, map_location="cpu")
+    return checkpoint.get("state_dict", checkpoint)
+
+
+def average_state_dicts(state_dicts):
+    """Average floating point weights, other buffers come from the first."""
+    soup = {}
+    for key, value in state_dicts[0].items():
+        if value.is_floating_point():
+            soup[key] = torch.stack([sd[key] for sd in state_dicts]).mean(dim=0)
+        else:
+            soup[key] = value.clone()
+    return soup
+
+
+def alert_index(config, label_map_path, alert_label):
+    """Result index of `alert_label`, mapped like `StdetPredictor`."""
+    with open(label_map_path) as f:
+        lines = [x.strip().split(": ") for x in f.readlines() if x.strip()]
+    label_map = {int(x[0]): x[1] for x in lines}
+    try:
+        if config["data"]["train"]["custom_classes"] is not None:
+            label_map = {
+                id + 1: label_map[cls]
+                for id, cls in enumerate(config["data"]["train"]["custom_classes"])
+            }
+    except KeyError:
+        pass
+    label_ids = {name: id for id, name in label_map.items()}
+    return label_ids[alert_label] - 1
+
+
+def collect_scores(model, args):
+    """Return [num_bboxes, num_classes] scores of all recorded clips."""
+    scores = []
+    with torch.no_grad():
+        for _, inputs in load_records(args.records, args.device, args.max_clips):
+            result = model(**inputs)[0]
+            num_bboxes = len(inputs["proposals"][0][0])
+            scores.append(np.stack([res[:num_bboxes, 4] for res in result], axis=1))
+    return np.concatenate(scores)
+
+
+class SoupValidator:
+    """Compare scores with the ensemble on recorded clips.
+
+    Args:
+        member_scores (list[ndarray]): [num_bboxes, num_classes] scores of
+            every member.
+        alert_col (int): Result index of the alert label.
+        score_thr (float): The threshold of human action score.
+    """
+
+    def __init__(self, member_scores, alert_col, score_thr):
+        member_scores = np.stack(member_scores)
+        self.reference = member_scores.mean(axis=0)
+        self.alert_col = alert_col
+        self.score_thr = score_thr
+        self.reference_alerts = self.alerts(member_scores)
+
+    def alerts(self, scores):
+        """Alerts of each bbox, like the ensemble demo's mean vote."""
+        if scores.ndim == 2:
+            scores = scores[np.newaxis]
+        fused = fuse_scores(scores, "mean", vote_thr=self.score_thr)
+        return fused[:, self.alert_col] >= self.score_thr
+
+    def compare(self, scores):
+        alert_diff = np.abs(scores - self.reference)[:, self.alert_col]
+        alerts = self.alerts(scores)
+        return dict(
+            mae=float(np.abs(scores - self.reference).mean()),
+            alert_mae=float(alert_diff.mean()),
+            alert_max_diff=float(alert_diff.max()),
+            alerts=int(alerts.sum()),
+            alert_agreement=float((alerts == self.reference_alerts).mean()),
+        )
+
+
+def main(args):
+    if os.path.isdir(args.config):
+        args.config = os.path.join(args.config, sorted(os.listdir(args.config))[0])
+    config = Config.fromfile(args.config)
+    config.merge_from_dict(args.cfg_options)
+    try:
+        # different actions should have the same number of bboxes
+        config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
+    except KeyError:
+        pass
+
+    checkpoints = sorted(
+        file for file in os.listdir(args.checkpoint) if file.endswith(".pth")
+    )
+    state_dicts = [
+        load_state_dict(os.path.join(args.checkpoint, file)) for file in checkpoints
+    ]
+    assert args.records or args.method == "uniform", "greedy soups need --records"
+
+    model = None
+    if args.records:
+        config.model.backbone.pretrained = None
+        model = build_detector(config.model, test_cfg=config.get("test_cfg"))
+        model.to(args.device)
+        model.eval()
+
+    def evaluate(state_dict):
+        model.load_state_dict(state_dict)
+        return collect_scores(model, args)
+
+    report = dict(method=args.method, members=checkpoints)
+    validator = None
+    if model is not None:
+        member_scores = [evaluate(state_dict) for state_dict in state_dicts]
+        validator = SoupValidator(
+            member_scores,
+            alert_index(config, args.label_map, args.alert_label),
+            args.action_score_thr,
+        )
+        report["num_bboxes"] = len(validator.reference)
+        report["ensemble_alerts"] = int(validator.reference_alerts.sum())
+        report["member_results"] = {
+            file: validator.compare(scores)
+            for file, scores in zip(checkpoints, member_scores)
+        }
+
+    if args.method == "uniform":
+        ingredients = list(range(len(checkpoints)))
+        soup = average_state_dicts(state_dicts)
+    else:
+        # start from the member closest to the ensemble and keep adding
+        # members while the soup gets closer
+        order = sorted(
+            range(len(checkpoints)),
+            key=lambda idx: report["member_results"][checkpoints[idx]]["mae"],
+        )
+        ingredients = [order[0]]
+        soup = state_dicts[order[0]]
+        best = report["member_results"][checkpoints[order[0]]]["mae"]
+        for idx in order[1:]:
+            candidate = average_state_dicts(
+                [state_dicts[i] for i in ingredients + [idx]]
+            )
+            mae = validator.compare(evaluate(candidate))["mae"]
+            print(f"{checkpoints[idx]}: {mae:.4f} vs {best:.4f}")
+            if mae <= best:
+                ingredients.append(idx)
+                soup, best = candidate, mae
+    report["ingredients"] = [checkpoints[idx] for idx in ingredients]
+
+    if validator is not None:
+        report["soup_results"] = validator.compare(evaluate(soup))
+
+    torch.save(
+        dict(state_dict=soup, meta=dict(soup=args.method, **report)), args.out
+    )
+    report_path = args.report or os.path.splitext(args.out)[0] + ".json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Saved soup of {len(ingredients)} members to {args.out}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
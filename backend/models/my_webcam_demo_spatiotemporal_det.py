@@ -4,11 +4,9 @@
 Some codes are based on https://github.com/facebookresearch/SlowFast
 """
 import os
-import pafy
 import datetime
 import argparse
 import atexit
-import copy
 import logging
 import queue
 import threading
@@ -26,10 +24,31 @@ import mmcv
 import numpy as np
 import torch
 from mmcv import Config, DictAction
-from mmcv.runner import load_checkpoint
 
 from mmaction.models import build_detector
 
+from clip_records import ClipRecorder
+from frame_buffer import ClipNormalizer, FrameRingBuffer
+from model_cache import ModelLoader
+from onnx_backend import (
+    DetectorPreprocessor,
+    backbone_outputs,
+    create_session,
+    detector_outputs,
+)
+from stdet_server import AUTHKEY_ENV, StdetClient
+from stream_utils import (
+    QUEUE_POLICIES,
+    BoundedTaskQueue,
+    FramePlanner,
+    PacingClock,
+    ReorderBuffer,
+    Stage,
+    StagePipeline,
+    resolve_input_video,
+)
+from tracker import IouTracker, TrackScoreCache
+
 try:
     from mmdet.apis import inference_detector, init_detector
 except (ImportError, ModuleNotFoundError):
@@ -43,8 +62,6 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 url = "https://www.youtube.com/watch?v=bPNg0cPvTDw"
-video = pafy.new(url)
-best = video.getbest(preftype="mp4")
 
 
 def parse_args():
@@ -78,6 +95,49 @@ def parse_args():
         default=("stdet_model/my_mmdet.pth"),
         help="human detection checkpoint file/url",
     )
+    parser.add_argument(
+        "--backend",
+        default="pytorch",
+        choices=("pytorch", "onnxruntime"),
+        help="runtime of the models, onnxruntime runs the graphs exported by "
+        "`onnx_export.py` on CPU",
+    )
+    parser.add_argument(
+        "--det-onnx",
+        default="stdet_model/my_mmdet.onnx",
+        help="human detector exported by `onnx_export.py`",
+    )
+    parser.add_argument(
+        "--stdet-onnx",
+        default="stdet_model/my_stdet_backbone.onnx",
+        help="stdet backbone exported by `onnx_export.py`",
+    )
+    parser.add_argument(
+        "--ort-threads",
+        default=0,
+        type=int,
+        help="onnxruntime intra-op threads of each model, <= 0 keeps the "
+        "default",
+    )
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="the stdet and human detection checkpoints are int8 models saved "
+        "by `quantize.py`, which run on CPU",
+    )
+    parser.add_argument(
+        "--model-cache",
+        default="stdet_model/snapshots",
+        help="folder of model snapshots with their checkpoints applied, which "
+        "load faster than building the models, empty to disable",
+    )
+    parser.add_argument(
+        "--warmup",
+        default=1,
+        type=int,
+        help="forward passes of each model on blank inputs before frames "
+        "flow, 0 to disable",
+    )
     parser.add_argument(
         "--det-score-thr",
         type=float,
@@ -86,10 +146,18 @@ def parse_args():
     )
     parser.add_argument(
         "--input-video",
-        default=best.url,
+        default=url,
         type=str,
         help="webcam id or input video file/url",
     )
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        default=[],
+        help="`area_id=source` pairs of several cameras, e.g. "
+        "`1=rtsp://cam1 2=rtsp://cam2`. All streams share one set of models. "
+        "Overrides --input-video, and can not be combined with --show",
+    )
     parser.add_argument(
         "--label-map", default="stdet_model/label_map.txt", help="label map file"
     )
@@ -129,6 +197,149 @@ def parse_args():
     parser.add_argument(
         "--clip-vis-length", default=8, type=int, help="Number of draw frames per clip."
     )
+    parser.add_argument(
+        "--max-labels-per-bbox",
+        default=5,
+        type=int,
+        help="max number of actions kept and drawn per person, highest "
+        "scores first",
+    )
+    parser.add_argument(
+        "--input-dtype",
+        default="float32",
+        choices=("float32", "float16"),
+        help="data type of stdet model inputs, float16 also runs the stdet "
+        "model in half precision",
+    )
+    parser.add_argument(
+        "--max-speed",
+        action="store_true",
+        help="read video files as fast as possible instead of in real time",
+    )
+    parser.add_argument(
+        "--read-queue-size",
+        default=4,
+        type=int,
+        help="max number of clips waiting for inference, <= 0 means unbounded",
+    )
+    parser.add_argument(
+        "--read-queue-policy",
+        default="block",
+        choices=QUEUE_POLICIES,
+        help="what to do when the read queue is full. `drop-oldest` and "
+        "`keep-latest` skip inference of stale clips to stay real-time",
+    )
+    parser.add_argument(
+        "--frame-buffer-clips",
+        default=0,
+        type=int,
+        help="number of clips the frame ring buffer holds besides the current "
+        "window, <= 0 sizes it from the read queue, stage queues and workers, "
+        "plus the reorder window with parallel workers",
+    )
+    parser.add_argument(
+        "--stage-queue-size",
+        default=2,
+        type=int,
+        help="max number of clips waiting in front of each inference stage",
+    )
+    parser.add_argument(
+        "--detect-workers",
+        default=1,
+        type=int,
+        help="number of threads running the human detector in parallel",
+    )
+    parser.add_argument(
+        "--detect-batch-size",
+        default=1,
+        type=int,
+        help="max number of keyframes, from any camera, detected in one "
+        "forward pass",
+    )
+    parser.add_argument(
+        "--detect-batch-timeout",
+        default=0.02,
+        type=float,
+        help="max seconds to wait for more keyframes to fill a detection batch",
+    )
+    parser.add_argument(
+        "--detect-interval",
+        default=1,
+        type=int,
+        help="run the human detector at least every n clips of a camera and "
+        "propagate bboxes with a tracker in between, 1 disables tracking",
+    )
+    parser.add_argument(
+        "--track-min-conf",
+        default=0.5,
+        type=float,
+        help="run the human detector before the interval ends when a track's "
+        "confidence, its detection score decayed per propagated clip, falls "
+        "below this value",
+    )
+    parser.add_argument(
+        "--track-decay",
+        default=0.9,
+        type=float,
+        help="track confidence decay per propagated clip",
+    )
+    parser.add_argument(
+        "--stdet-safe-thr",
+        default=0,
+        type=float,
+        help="cache stdet results per track and re-evaluate swimmers whose "
+        "drowning score stayed below this value only every "
+        "--stdet-safe-interval clips, <= 0 disables the cache",
+    )
+    parser.add_argument(
+        "--stdet-safe-interval",
+        default=4,
+        type=int,
+        help="max number of clips between two stdet evaluations of a safe "
+        "swimmer",
+    )
+    parser.add_argument(
+        "--stdet-workers",
+        default=1,
+        type=int,
+        help="number of threads running the stdet model in parallel",
+    )
+    parser.add_argument(
+        "--stdet-server",
+        default=None,
+        help="address of a running `stdet_server.py`, the stdet model is then "
+        "not loaded in this process",
+    )
+    parser.add_argument(
+        "--stdet-authkey",
+        default=os.environ.get(AUTHKEY_ENV),
+        help=f"secret key of the stdet server, defaults to ${AUTHKEY_ENV}",
+    )
+    parser.add_argument(
+        "--record-clips",
+        default=None,
+        help="folder to save stdet model inputs of clips with people to, for "
+        "offline validation and calibration tools",
+    )
+    parser.add_argument(
+        "--record-max-clips",
+        default=100,
+        type=int,
+        help="max number of recorded clips, <= 0 means unbounded, a 32 frame clip "
+        "takes up to about 11 MB plus its display keyframe",
+    )
+    parser.add_argument(
+        "--reorder-window",
+        default=16,
+        type=int,
+        help="max number of clips the display may wait for out of order",
+    )
+    parser.add_argument(
+        "--reorder-timeout",
+        default=1.0,
+        type=float,
+        help="seconds the display waits for a slow clip before skipping it",
+    )
     parser.add_argument(
         "--cfg-options",
         nargs="+",
@@ -149,24 +360,36 @@ class TaskInfo:
     Transmit data around three threads.
 
     1) Read Thread: Create task and put task into read queue. Init `frames`,
-        `processed_frames`, `img_shape`, `ratio`, `clip_vis_length`.
-    2) Main Thread: Get data from read queue, predict human bboxes and stdet
-        action labels, draw predictions and put task into display queue. Init
-        `display_bboxes`, `stdet_bboxes` and `action_preds`, update `frames`.
-    3) Display Thread: Get data from display queue, show/write frames and
-        delete task.
+        `processed_frames`, `frames_start`, `img_shape`, `ratio`,
+        `clip_vis_length`.
+    2) Main Thread: Get data from read queue and feed the stage pipeline,
+        whose threads predict human bboxes and stdet action labels, draw
+        predictions and put task into display queue. Init `display_bboxes`,
+        `stdet_bboxes` and `action_preds`, update `frames`.
+    3) Display Thread: Get data from display queue, show/write frames,
+        release frames in the ring buffer and delete task.
+
+    `frames` and `processed_frames` are reference counted views into the
+    `FrameRingBuffer` of `ClipHelper`, so overlapping tasks share frames and
+    passing a task between threads never copies them. Drawing copies only
+    the frames it modifies. Processed frames are kept as uint8 and the
+    sampled clip is normalized by the shared `normalizer` into a reused
+    input tensor.
     """
 
     def __init__(self):
         self.id = -1
+        self.area_id = None  # pool area of the source camera
 
         # raw frames, used as human detector input, draw predictions input
         # and output, display input
         self.frames = None
+        self.frames_start = -1  # sequence number of frames[0] in ring buffer
 
         # stdet params
-        self.processed_frames = None  # model inputs
+        self.processed_frames = None  # model inputs, resized uint8 frames
         self.frames_inds = None  # select frames from processed frames
+        self.normalizer = None  # write selected frames into the input tensor
         self.img_shape = None  # model inputs, processed frame shape
         # `action_preds` is `list[list[tuple]]`. The outer brackets indicate
         # different bboxes and the intter brackets indicate different action
@@ -176,28 +399,34 @@ class TaskInfo:
         # human bboxes with the format (xmin, ymin, xmax, ymax)
         self.display_bboxes = None  # bboxes coords for self.frames
         self.stdet_bboxes = None  # bboxes coords for self.processed_frames
+        self.track_ids = None  # tracker id of each bbox, if tracking
         self.ratio = None  # processed_frames.shape[1::-1]/frames.shape[1::-1]
 
         # for each clip, draw predictions on clip_vis_length frames
         self.clip_vis_length = -1
 
+        # time when the last frame of the clip was read, for latency logs
+        self.read_time = None
+
     def add_frames(self, idx, frames, processed_frames):
         """Add the clip and corresponding id.
 
         Args:
             idx (int): the current index of the clip.
-            frames (list[ndarray]): list of images in "BGR" format.
-            processed_frames (list[ndarray]): list of resize and normed images
-                in "BGR" format.
+            frames (FrameWindow): view of images in "BGR" format.
+            processed_frames (FrameWindow): view of resized images in "BGR"
+                format.
         """
         self.frames = frames
         self.processed_frames = processed_frames
+        self.frames_start = frames.start
         self.id = idx
-        self.img_shape = processed_frames[0].shape[:2]
+        self.img_shape = processed_frames.frame_shape[:2]
 
-    def add_bboxes(self, display_bboxes):
+    def add_bboxes(self, display_bboxes, track_ids=None):
         """Add correspondding bounding boxes."""
         self.display_bboxes = display_bboxes
+        self.track_ids = track_ids
         self.stdet_bboxes = display_bboxes.clone()
         self.stdet_bboxes[:, ::2] = self.stdet_bboxes[:, ::2] * self.ratio[0]
         self.stdet_bboxes[:, 1::2] = self.stdet_bboxes[:, 1::2] * self.ratio[1]
@@ -209,12 +438,11 @@ class TaskInfo:
     def get_model_inputs(self, device):
         """Convert preprocessed images to MMAction2 STDet model inputs."""
         cur_frames = [self.processed_frames[idx] for idx in self.frames_inds]
-        input_array = np.stack(cur_frames).transpose((3, 0, 1, 2))[np.newaxis]
-        input_tensor = torch.from_numpy(input_array).to(device)
+        input_tensor = self.normalizer(cur_frames, device)
         return dict(
             return_loss=False,
             img=[input_tensor],
-            proposals=[[self.stdet_bboxes]],
+            proposals=[[self.stdet_bboxes.to(input_tensor.dtype)]],
             img_metas=[[dict(img_shape=self.img_shape)]],
         )
 
@@ -231,11 +459,29 @@ class BaseHumanDetector(metaclass=ABCMeta):
 
     @abstractmethod
     def _do_detect(self, image):
-        """Get human bboxes with shape [n, 4].
+        """Get human bboxes with shape [n, 4], or [n, 5] with scores.
 
         The format of bboxes is (xmin, ymin, xmax, ymax) in pixels.
         """
 
+    def _do_detect_batch(self, images):
+        """Get human bboxes of several images, one array per image.
+
+        Detectors supporting batched inference should override this.
+        """
+        return [self._do_detect(image) for image in images]
+
+    def warmup(self, image_shape, num_iters=1):
+        """Detect on blank images, to pay lazy init costs before frames flow.
+
+        Args:
+            image_shape (tuple[int]): Shape (h, w, c) of the keyframes.
+            num_iters (int): Number of detector calls. Default: 1.
+        """
+        image = np.zeros(image_shape, dtype=np.uint8)
+        for _ in range(num_iters):
+            self._do_detect_batch([image])
+
     def predict(self, task):
         """Add keyframe bboxes to task."""
         # keyframe idx == (clip_len * frame_interval) // 2
@@ -244,6 +490,22 @@ class BaseHumanDetector(metaclass=ABCMeta):
         # call detector
         bboxes = self._do_detect(keyframe)
 
+        return self._update_task(task, bboxes)
+
+    def predict_batch(self, tasks):
+        """Add keyframe bboxes to several tasks with one detector call.
+
+        Tasks may come from different clips or cameras.
+        """
+        keyframes = [task.frames[len(task.frames) // 2] for task in tasks]
+        for task, bboxes in zip(tasks, self._do_detect_batch(keyframes)):
+            self._update_task(task, bboxes)
+        return tasks
+
+    def _update_task(self, task, bboxes, track_ids=None):
+        # drop detection scores
+        bboxes = bboxes[:, :4]
+
         # convert bboxes to torch.Tensor and move to target device
         if isinstance(bboxes, np.ndarray):
             bboxes = torch.from_numpy(bboxes).to(self.device)
@@ -251,7 +513,7 @@ class BaseHumanDetector(metaclass=ABCMeta):
             bboxes = bboxes.to(self.device)
 
         # update task
-        task.add_bboxes(bboxes)
+        task.add_bboxes(bboxes, track_ids)
 
         return task
 
@@ -266,20 +528,178 @@ class MmdetHumanDetector(BaseHumanDetector):
         score_thr (float): The threshold of human detection score.
         person_classid (int): Choose class from detection results.
             Default: 0. Suitable for COCO pretrained models.
+        quantized (bool): Whether `ckpt` is an int8 model saved by
+            `quantize.py`, which runs on CPU. Default: False.
+        loader (ModelLoader, optional): Loader of the model. Default: None,
+            building it without snapshots.
     """
 
-    def __init__(self, config, ckpt, device, score_thr, person_classid=0):
+    def __init__(
+        self,
+        config,
+        ckpt,
+        device,
+        score_thr,
+        person_classid=0,
+        quantized=False,
+        loader=None,
+    ):
         super().__init__(device)
-        self.model = init_detector(config, ckpt, device)
+        config = Config.fromfile(config)
+        loader = loader or ModelLoader()
+        self.model = loader.load(
+            config.model,
+            ckpt,
+            lambda: init_detector(config, None, "cpu"),
+            quantized=quantized,
+        ).to(device)
         self.person_classid = person_classid
         self.score_thr = score_thr
 
     def _do_detect(self, image):
-        """Get bboxes in shape [n, 4] and values in pixels."""
+        """Get bboxes and scores in shape [n, 5] and values in pixels."""
         result = inference_detector(self.model, image)[self.person_classid]
-        result = result[result[:, 4] >= self.score_thr][:, :4]
+        result = result[result[:, 4] >= self.score_thr]
         return result
 
+    def _do_detect_batch(self, images):
+        """Get bboxes of several images in one forward pass."""
+        results = inference_detector(self.model, images)
+        results = [result[self.person_classid] for result in results]
+        return [result[result[:, 4] >= self.score_thr] for result in results]
+
+
+class OnnxHumanDetector(BaseHumanDetector):
+    """mmdetection human detector exported by `onnx_export.py`.
+
+    Runs in onnxruntime on CPU, with the test pipeline of the mmdet config.
+
+    Args:
+        config (str): Path to mmdetection config.
+        onnx_file (str): Path to the exported detector.
+        score_thr (float): The threshold of human detection score.
+        person_classid (int): Choose class from detection results.
+            Default: 0. Suitable for COCO pretrained models.
+        num_threads (int): onnxruntime intra-op threads, <= 0 keeps the
+            default. Default: 0.
+    """
+
+    def __init__(self, config, onnx_file, score_thr, person_classid=0, num_threads=0):
+        super().__init__("cpu")
+        self.preprocess = DetectorPreprocessor(Config.fromfile(config))
+        self.session = create_session(onnx_file, num_threads)
+        self.person_classid = person_classid
+        self.score_thr = score_thr
+
+    def _do_detect(self, image):
+        """Get bboxes and scores in shape [n, 5] and values in pixels."""
+        dets, labels = detector_outputs(self.session, *self.preprocess(image))
+        return dets[(labels == self.person_classid) & (dets[:, 4] >= self.score_thr)]
+
+
+class TrackingHumanDetector(BaseHumanDetector):
+    """Human detector which runs the full detector only on some keyframes.
+
+    An `IouTracker` per camera propagates bboxes to the keyframes in between
+    and gives every bbox a persistent track id.
+    The wrapped detector runs on the first clip of each camera, when
+    `detect_interval` clips have passed since its last detection, and when
+    the least confident track falls below `min_confidence`. Swimmers
+    entering the view are only found by the next detection, so
+    `detect_interval` trades detector invocations against bbox accuracy.
+    The invocation rate and the mean IoU between propagated and detected
+    bboxes, i.e. the propagation drift, are logged to tune it.
+
+    Args:
+        detector (BaseHumanDetector): Full human detector.
+        detect_interval (int): Max number of clips between two detections
+            of the same camera.
+        min_confidence (float): Detect again when a track's confidence falls
+            below this value. Default: 0.5.
+        decay (float): Track confidence decay per propagated clip.
+            Default: 0.9.
+        iou_thr (float): Min IoU to match a detection with a track.
+            Default: 0.3.
+    """
+
+    def __init__(
+        self, detector, detect_interval, min_confidence=0.5, decay=0.9, iou_thr=0.3
+    ):
+        super().__init__(detector.device)
+        self.detector = detector
+        self.detect_interval = detect_interval
+        self.min_confidence = min_confidence
+        self.decay = decay
+        self.iou_thr = iou_thr
+        self.trackers = {}  # area_id -> IouTracker
+        self.last_detections = {}  # area_id -> task id of the last detection
+        self.lock = threading.Lock()
+        self.num_keyframes = 0
+        self.num_detections = 0
+
+    def _do_detect(self, image):
+        return self.detector._do_detect(image)
+
+    def _do_detect_batch(self, images):
+        return self.detector._do_detect_batch(images)
+
+    def _needs_detection(self, task):
+        tracker = self.trackers.get(task.area_id)
+        if tracker is None:
+            tracker = IouTracker(iou_thr=self.iou_thr, decay=self.decay)
+            self.trackers[task.area_id] = tracker
+        last_detection = self.last_detections.get(task.area_id)
+        return (
+            last_detection is None
+            or task.id - last_detection >= self.detect_interval
+            or tracker.confidence(task.id) < self.min_confidence
+        )
+
+    def predict(self, task):
+        return self.predict_batch([task])[0]
+
+    def predict_batch(self, tasks):
+        """Detect or propagate bboxes of several tasks."""
+        with self.lock:
+            detect_tasks = []
+            for task in tasks:
+                if self._needs_detection(task):
+                    detect_tasks.append(task)
+                    self.last_detections[task.area_id] = task.id
+                else:
+                    tracker = self.trackers[task.area_id]
+                    self._update_task(
+                        task, tracker.bboxes(task.id), tracker.track_ids()
+                    )
+
+        if detect_tasks:
+            keyframes = [task.frames[len(task.frames) // 2] for task in detect_tasks]
+            results = self._do_detect_batch(keyframes)
+        else:
+            results = []
+
+        with self.lock:
+            for task, result in zip(detect_tasks, results):
+                if isinstance(result, torch.Tensor):
+                    result = result.cpu().numpy()
+                scores = result[:, 4] if result.shape[1] > 4 else None
+                track_ids, drift = self.trackers[task.area_id].update(
+                    task.id, result[:, :4], scores
+                )
+                if drift is not None:
+                    logger.debug(
+                        f"Tracker of area {task.area_id}: propagated bboxes "
+                        f"match detections with mean IoU {drift:.2f}"
+                    )
+                self._update_task(task, result, track_ids)
+            self.num_keyframes += len(tasks)
+            self.num_detections += len(detect_tasks)
+            logger.debug(
+                f"Human detector ran on {self.num_detections} of "
+                f"{self.num_keyframes} keyframes"
+            )
+        return tasks
+
 
 class StdetPredictor:
     """Wrapper for MMAction2 spatio-temporal action models.
@@ -291,33 +711,101 @@ class StdetPredictor:
         score_thr (float): The threshold of human action score.
         label_map_path (str): Path to label map file. The format for each line
             is `{class_id}: {class_name}`.
+        fp16 (bool): Whether to run the model in half precision, it expects
+            float16 inputs. Default: False.
+        cache (TrackScoreCache, optional): Reuse results of clips whose
+            tracks are all stable and safe. Default: None.
+        top_k (int, optional): Max number of actions kept per bbox, the
+            highest scoring first. Default: None, keeping every action above
+            `score_thr` in label map order.
+        quantized (bool): Whether `checkpoint` is an int8 model saved by
+            `quantize.py`, which runs on CPU. Default: False.
+        label_map (dict, optional): Label map already read from
+            `label_map_path`, shared by several predictors. Default: None.
+        loader (ModelLoader, optional): Loader of the model. Default: None,
+            building it without snapshots.
     """
 
-    def __init__(self, config, checkpoint, device, score_thr, label_map_path):
+    def __init__(
+        self,
+        config,
+        checkpoint,
+        device,
+        score_thr,
+        label_map_path,
+        fp16=False,
+        cache=None,
+        top_k=None,
+        quantized=False,
+        label_map=None,
+        loader=None,
+    ):
         self.score_thr = score_thr
+        self.cache = cache
+        self.top_k = top_k
 
         # load model
         config.model.backbone.pretrained = None
-        model = build_detector(config.model, test_cfg=config.get("test_cfg"))
-        load_checkpoint(model, checkpoint, map_location="cpu")
+        loader = loader or ModelLoader()
+        model = loader.load(
+            config.model,
+            checkpoint,
+            lambda: build_detector(config.model, test_cfg=config.get("test_cfg")),
+            quantized=quantized,
+        )
         model.to(device)
-        model.eval()
+        if fp16:
+            model.half()
         self.model = model
         self.device = device
 
-        # init label map, aka class_id to class_name dict
+        if label_map is None:
+            label_map = self._load_label_map(config, label_map_path)
+        self.label_map = label_map
+        self.label_ids, self.label_names = self._label_arrays(self.label_map)
+
+    @staticmethod
+    def _load_label_map(config, label_map_path):
+        """Init label map, aka class_id to class_name dict."""
         with open(label_map_path) as f:
             lines = f.readlines()
         lines = [x.strip().split(": ") for x in lines]
-        self.label_map = {int(x[0]): x[1] for x in lines}
+        label_map = {int(x[0]): x[1] for x in lines}
         try:
             if config["data"]["train"]["custom_classes"] is not None:
-                self.label_map = {
-                    id + 1: self.label_map[cls]
+                label_map = {
+                    id + 1: label_map[cls]
                     for id, cls in enumerate(config["data"]["train"]["custom_classes"])
                 }
         except KeyError:
             pass
+        return label_map
+
+    @staticmethod
+    def _label_arrays(label_map):
+        """Return result indices and names of the labels, in label map order."""
+        label_ids = sorted(label_map)
+        label_names = np.array([label_map[id] for id in label_ids], dtype=object)
+        return np.array(label_ids) - 1, label_names
+
+    def _inference(self, task):
+        """Return the stdet result of a task, per class bboxes and scores."""
+        return self._forward(task.get_model_inputs(self.device))
+
+    def _forward(self, inputs):
+        """Return the stdet result of `TaskInfo.get_model_inputs` outputs."""
+        with torch.no_grad():
+            return self.model(**inputs)[0]
+
+    def warmup(self, inputs, num_iters=1):
+        """Run the model before frames flow, to pay lazy init costs.
+
+        Args:
+            inputs (dict): Model inputs, see `ClipHelper.blank_model_inputs`.
+            num_iters (int): Number of forward passes. Default: 1.
+        """
+        for _ in range(num_iters):
+            self._forward(inputs)
 
     def predict(self, task):
         """Spatio-temporval Action Detection model inference."""
@@ -325,30 +813,174 @@ class StdetPredictor:
         if len(task.stdet_bboxes) == 0:
             return task
 
-        with torch.no_grad():
-            result = self.model(**task.get_model_inputs(self.device))[0]
-
-        # pack results of human detector and stdet
-        preds = []
-        for _ in range(task.stdet_bboxes.shape[0]):
-            preds.append([])
-        for class_id in range(len(result)):
-            if class_id + 1 not in self.label_map:
-                continue
-            for bbox_id in range(task.stdet_bboxes.shape[0]):
-                if result[class_id][bbox_id, 4] > self.score_thr:
-                    preds[bbox_id].append(
-                        (self.label_map[class_id + 1], result[class_id][bbox_id, 4])
-                    )
+        # reuse cached results if every swimmer has been safe for a while
+        use_cache = self.cache is not None and task.track_ids is not None
+        if use_cache:
+            preds = self.cache.lookup(task.area_id, task.track_ids, task.id)
+            logger.debug(
+                f"Stdet cache reused {self.cache.num_hits} of "
+                f"{self.cache.num_clips} clips"
+            )
+            if preds is not None:
+                task.add_action_preds(preds)
+                return task
+
+        result = self._inference(task)
+        scores, label_names = self._score_matrix(result, task.stdet_bboxes.shape[0])
+        preds = self._pack_scores(scores, label_names)
 
         # update task
         # `preds` is `list[list[tuple]]`. The outer brackets indicate
         # different bboxes and the intter brackets indicate different action
         # results for the same bbox. tuple contains `class_name` and `score`.
         task.add_action_preds(preds)
+        if use_cache:
+            self.cache.update(
+                task.area_id,
+                task.track_ids,
+                task.id,
+                preds,
+                self.cache.risk_scores(scores, label_names),
+            )
 
         return task
 
+    def _score_matrix(self, result, num_bboxes):
+        """Return [num_bboxes, num_labels] scores and names of the labels.
+
+        Only classes in the label map are kept, in label map order. Scores
+        are float32 even for half precision models, so `--input-dtype
+        float16` only changes the compute, never the score thresholds.
+
+        Args:
+            result (list[ndarray]): Stdet result, [n, 5] bboxes and scores
+                per class.
+            num_bboxes (int): Number of human bboxes.
+        """
+        scores = np.stack(
+            [res[:num_bboxes, 4].astype(np.float32, copy=False) for res in result],
+            axis=1,
+        )
+        valid = self.label_ids < scores.shape[1]
+        return scores[:, self.label_ids[valid]], self.label_names[valid]
+
+    def _pack_scores(self, scores, label_names):
+        """Pack a [num_bboxes, num_labels] score matrix into action predictions.
+
+        Returns:
+            list[list[tuple]]: Labels above `score_thr` and their scores, for
+                each bbox.
+        """
+        num_bboxes = scores.shape[0]
+
+        # threshold once, and only look up the names of the remaining labels
+        cols = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        if self.top_k is not None:
+            cols = np.argsort(-scores, axis=1, kind="stable")[:, : self.top_k]
+        top_scores = np.take_along_axis(scores, cols, axis=1)
+        bbox_ids, ranks = np.nonzero(top_scores > self.score_thr)
+        preds = [[] for _ in range(num_bboxes)]
+        for bbox_id, name, score in zip(
+            bbox_ids.tolist(),
+            label_names[cols[bbox_ids, ranks]],
+            top_scores[bbox_ids, ranks],
+        ):
+            preds[bbox_id].append((name, score))
+        return preds
+
+
+class RemoteStdetPredictor(StdetPredictor):
+    """StdetPredictor whose model runs in a `stdet_server.py` process.
+
+    Clips are normalized in this process and sent to the server with their
+    proposals, results are packed like `StdetPredictor`.
+
+    Args:
+        address (str): Address the stdet server listens on.
+        authkey (str | bytes): Secret key of the stdet server.
+        config (Config): Stdet config, only used for the label map.
+        score_thr (float): The threshold of human action score.
+        label_map_path (str): Path to label map file.
+        cache (TrackScoreCache, optional): See `StdetPredictor`.
+            Default: None.
+        top_k (int, optional): See `StdetPredictor`. Default: None.
+    """
+
+    def __init__(
+        self,
+        address,
+        authkey,
+        config,
+        score_thr,
+        label_map_path,
+        cache=None,
+        top_k=None,
+    ):
+        self.score_thr = score_thr
+        self.cache = cache
+        self.top_k = top_k
+        self.client = StdetClient(address, authkey)
+        self.device = "cpu"
+        self.label_map = self._load_label_map(config, label_map_path)
+        self.label_ids, self.label_names = self._label_arrays(self.label_map)
+
+    def _forward(self, inputs):
+        return self.client(
+            inputs["img"][0].numpy(),
+            inputs["proposals"][0][0].cpu().numpy(),
+            inputs["img_metas"][0][0]["img_shape"],
+        )
+
+
+class OnnxStdetPredictor(StdetPredictor):
+    """StdetPredictor whose backbone runs in onnxruntime on CPU.
+
+    The backbone exported by `onnx_export.py` does nearly all the work, the
+    RoI head stays in PyTorch and still loads its weights from `checkpoint`.
+
+    Args:
+        config (Config): Stdet config.
+        checkpoint (str): Path to stdet checkpoint.
+        onnx_file (str): Path to the exported backbone.
+        score_thr (float): The threshold of human action score.
+        label_map_path (str): Path to label map file.
+        num_threads (int): onnxruntime intra-op threads, <= 0 keeps the
+            default. Default: 0.
+        cache (TrackScoreCache, optional): See `StdetPredictor`.
+            Default: None.
+        top_k (int, optional): See `StdetPredictor`. Default: None.
+    """
+
+    def __init__(
+        self,
+        config,
+        checkpoint,
+        onnx_file,
+        score_thr,
+        label_map_path,
+        num_threads=0,
+        cache=None,
+        top_k=None,
+    ):
+        super().__init__(
+            config,
+            checkpoint,
+            "cpu",
+            score_thr,
+            label_map_path,
+            cache=cache,
+            top_k=top_k,
+        )
+        self.model.backbone = None  # replaced by the onnxruntime session
+        self.session = create_session(onnx_file, num_threads)
+
+    def _forward(self, inputs):
+        x = backbone_outputs(self.session, inputs["img"][0].numpy())
+        with torch.no_grad():
+            return self.model.roi_head.simple_test(
+                x, inputs["proposals"][0], inputs["img_metas"][0], rescale=False
+            )[0]
+
 
 class ClipHelper:
     """Multithrading utils to manage the lifecycle of task."""
@@ -358,15 +990,28 @@ class ClipHelper:
         config,
         display_height=0,
         display_width=0,
-        input_video=best.url,
+        input_video=url,
         predict_stepsize=40,
         output_fps=25,
         clip_vis_length=8,
         out_filename="demo/output.mp4",
         show=True,
         stdet_input_shortside=256,
+        frame_buffer_clips=8,
+        read_queue_size=4,
+        read_queue_policy="block",
+        max_speed=False,
+        input_dtype=np.float32,
+        reorder_window=16,
+        reorder_timeout=1.0,
+        area_id=None,
     ):
         self.cnt = 0
+        self.area_id = area_id
+        if area_id is None:
+            self.alert_path = "./static/drowning.jpg"
+        else:
+            self.alert_path = f"./static/drowning_{area_id}.jpg"
         # stdet sampling strategy
         val_pipeline = config.data.val.pipeline
         sampler = [x for x in val_pipeline if x["type"] == "SampleAVAFrames"][0]
@@ -381,7 +1026,7 @@ class ClipHelper:
 
         # source params
 
-        self.cap = cv2.VideoCapture(input_video)
+        self.cap = cv2.VideoCapture(resolve_input_video(input_video))
         self.webcam = False
         assert self.cap.isOpened()
 
@@ -398,6 +1043,12 @@ class ClipHelper:
         img_norm_cfg["mean"] = np.array(img_norm_cfg["mean"])
         img_norm_cfg["std"] = np.array(img_norm_cfg["std"])
         self.img_norm_cfg = img_norm_cfg
+        stdet_w, stdet_h = self.stdet_input_size
+        self.normalizer = ClipNormalizer(
+            clip_shape=(clip_len, stdet_h, stdet_w, 3),
+            dtype=input_dtype,
+            **img_norm_cfg,
+        )
 
         # task init params
         self.clip_vis_length = clip_vis_length
@@ -405,8 +1056,7 @@ class ClipHelper:
         self.buffer_size = self.window_size - self.predict_stepsize
         frame_start = self.window_size // 2 - (clip_len // 2) * frame_interval
         self.frames_inds = [frame_start + frame_interval * i for i in range(clip_len)]
-        self.buffer = []
-        self.processed_buffer = []
+        self.buffer_start = 0  # sequence number of the first frame of next task
 
         # output/display params
         if display_height > 0 and display_width > 0:
@@ -420,29 +1070,72 @@ class ClipHelper:
         self.ratio = tuple(
             n / o for n, o in zip(self.stdet_input_size, self.display_size)
         )
+
+        # frames of the current window plus `frame_buffer_clips` clips waiting
+        # in the read/display queues, preallocated once
+        self.frame_buffer = FrameRingBuffer(
+            capacity=self.window_size + frame_buffer_clips * self.predict_stepsize,
+            display_shape=(self.display_size[1], self.display_size[0], 3),
+            processed_shape=(self.stdet_input_size[1], self.stdet_input_size[0], 3),
+        )
+        logger.info(
+            f"Frame ring buffer of area {area_id}: {frame_buffer_clips} clips, "
+            f"{self.frame_buffer.capacity} frames, "
+            f"{self.frame_buffer.nbytes / 2**20:.0f} MB"
+        )
+        self.display_larger = (
+            self.display_size[0] * self.display_size[1]
+            >= self.stdet_input_size[0] * self.stdet_input_size[1]
+        )
         if output_fps <= 0:
             self.output_fps = int(self.cap.get(cv2.CAP_PROP_FPS))
         else:
             self.output_fps = output_fps
         self.show = show
+        self.window_name = "Demo" if area_id is None else f"Demo {area_id}"
         self.video_writer = None
-        if out_filename is not None:
-            self.video_writer = self.get_output_video_writer(out_filename)
+        source_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.clock = PacingClock(
+            source_fps if source_fps > 0 else self.output_fps, max_speed=max_speed
+        )
         display_start_idx = self.window_size // 2 - self.predict_stepsize // 2
         self.display_inds = [
             display_start_idx + i for i in range(self.predict_stepsize)
         ]
 
+        # show source frames at `output_fps`, and only resize the frames which
+        # are shown, sampled by stdet, used as the human detector keyframe or
+        # saved by `detect_drowning`
+        self.display_stride = 1
+        if source_fps > self.output_fps:
+            self.display_stride = round(source_fps / self.output_fps)
+        # the rate frames are really shown at, which is only close to
+        # `output_fps` when the source rate is no multiple of it
+        self.display_fps = self.output_fps
+        if source_fps > 0:
+            self.display_fps = source_fps / self.display_stride
+        if out_filename is not None:
+            self.video_writer = self.get_output_video_writer(out_filename)
+        self.planner = FramePlanner(
+            self.predict_stepsize,
+            stdet_inds=self.frames_inds,
+            clip_display_inds=[self.window_size // 2, self.display_inds[0]],
+            display_stride=self.display_stride,
+        )
+
         # display multi-theading params
         self.display_id = -1  # task.id for display queue
-        self.display_queue = {}
-        self.display_lock = threading.Lock()
+        self.display_queue = ReorderBuffer(
+            window=reorder_window, skip_timeout=reorder_timeout, on_late=self.release
+        )
         self.output_lock = threading.Lock()
 
         # read multi-theading params
         self.read_id = -1  # task.id for read queue
         self.read_id_lock = threading.Lock()
-        self.read_queue = queue.Queue()
+        self.read_queue = BoundedTaskQueue(
+            read_queue_size, read_queue_policy, on_drop=self.skip
+        )
         self.read_lock = threading.Lock()
         self.not_end = True  # cap.read() flag
 
@@ -451,13 +1144,30 @@ class ClipHelper:
 
         atexit.register(self.clean)
 
+    def blank_model_inputs(self, device):
+        """Model inputs of a blank clip with one full-frame bbox, for warmup."""
+        stdet_w, stdet_h = self.stdet_input_size
+        frame = np.zeros((stdet_h, stdet_w, 3), dtype=np.uint8)
+        img = self.normalizer([frame] * len(self.frames_inds), device)
+        proposals = torch.tensor(
+            [[0, 0, stdet_w - 1, stdet_h - 1]], dtype=img.dtype, device=img.device
+        )
+        return dict(
+            return_loss=False,
+            img=[img],
+            proposals=[[proposals]],
+            img_metas=[[dict(img_shape=(stdet_h, stdet_w))]],
+        )
+
     def read_fn(self):
         """Main function for read thread.
 
         Contains three steps:
 
-        1) Read and preprocess (resize + norm) frames from source.
-        2) Create task by frames from previous step and buffer.
+        1) Read and resize frames from source into the ring buffer. Only the
+           sizes some consumer needs are produced, stdet inputs are
+           normalized by the main thread.
+        2) Create task by a window of the ring buffer.
         3) Put task into read queue.
         """
         was_read = True
@@ -466,55 +1176,99 @@ class ClipHelper:
             # init task
             task = TaskInfo()
             task.clip_vis_length = self.clip_vis_length
+            task.area_id = self.area_id
             task.frames_inds = self.frames_inds
+            task.normalizer = self.normalizer
             task.ratio = self.ratio
 
-            # read buffer
-            frames = []
-            processed_frames = []
-            if len(self.buffer) != 0:
-                frames = self.buffer
-            if len(self.processed_buffer) != 0:
-                processed_frames = self.processed_buffer
-
-            # read and preprocess frames from source and update task
+            # read and preprocess frames from source into the ring buffer
             with self.read_lock:
                 before_read = time.time()
-                read_frame_cnt = self.window_size - len(frames)
-                while was_read and len(frames) < self.window_size:
-                    was_read, frame = self.cap.read()
-                    if not self.webcam:
-                        # Reading frames too fast may lead to unexpected
-                        # performance degradation. If you have enough
-                        # resource, this line could be commented.
-                        time.sleep(1 / self.output_fps)
+                window_end = self.buffer_start + self.window_size
+                read_frame_cnt = window_end - self.frame_buffer.head
+                decode_cnt = 0
+                while was_read and self.frame_buffer.head < window_end:
+                    if not self.frame_buffer.wait_writable():
+                        return
+                    seq = self.frame_buffer.head
+                    need_display = self.planner.needs_display(seq)
+                    need_stdet = self.planner.needs_stdet(seq)
+                    if need_display or need_stdet:
+                        was_read, frame = self.cap.read()
+                        decode_cnt += 1
+                    else:
+                        # nobody uses this frame, skip decoding it
+                        was_read, frame = self.cap.grab(), None
+                    if was_read and not self.webcam:
+                        # Reading frames faster than the source may lead to
+                        # unexpected performance degradation, so follow the
+                        # source timestamps unless `max_speed` is set.
+                        self.clock.wait(self.cap.get(cv2.CAP_PROP_POS_MSEC))
                     if was_read:
-                        frames.append(mmcv.imresize(frame, self.display_size))
-                        processed_frame = mmcv.imresize(
-                            frame, self.stdet_input_size
-                        ).astype(np.float32)
-                        _ = mmcv.imnormalize_(processed_frame, **self.img_norm_cfg)
-                        processed_frames.append(processed_frame)
+                        display_slot, processed_slot = self.frame_buffer.next_slot()
+                        self.preprocess(
+                            frame,
+                            display_slot if need_display else None,
+                            processed_slot if need_stdet else None,
+                        )
+                        self.frame_buffer.commit()
+            frames, processed_frames = self.frame_buffer.acquire(self.buffer_start)
             task.add_frames(self.read_id + 1, frames, processed_frames)
 
-            # update buffer
+            # the last `buffer_size` frames are shared with the next task,
+            # drop the read thread's references to the others
             if was_read:
-                self.buffer = frames[-self.buffer_size :]
-                self.processed_buffer = processed_frames[-self.buffer_size :]
+                step = self.window_size - self.buffer_size
+                self.frame_buffer.release(self.buffer_start, step)
+                self.buffer_start += step
+            else:
+                self.frame_buffer.release(self.buffer_start, len(frames))
 
             # update read state
             with self.read_id_lock:
                 self.read_id += 1
                 self.not_end = was_read
 
-            self.read_queue.put((was_read, copy.deepcopy(task)))
+            task.read_time = time.time()
+            # the last task must reach the main thread to end the pipeline
+            self.read_queue.put((was_read, task), droppable=was_read)
             cur_time = time.time()
+            mean_lateness, max_lateness, jumps = self.clock.pop_stats()
             logger.debug(
                 f"Read thread: {1000*(cur_time - start_time):.0f} ms, "
-                f"{read_frame_cnt / (cur_time - before_read):.0f} fps"
+                f"{read_frame_cnt / (cur_time - before_read):.0f} fps, "
+                f"decoded {decode_cnt}/{read_frame_cnt}, "
+                f"lateness mean {mean_lateness:.0f} ms max {max_lateness:.0f} ms, "
+                f"timestamp jumps {jumps}, "
+                f"dropped {self.read_queue.dropped}/{self.read_queue.put_count}"
             )
             start_time = cur_time
 
+    def preprocess(self, frame, display_out=None, stdet_out=None):
+        """Resize a decoded frame into preallocated display/stdet buffers.
+
+        When both sizes are needed, the frame is resized once to the larger
+        one and the smaller one is derived from it.
+
+        Args:
+            frame (ndarray): Decoded frame in "BGR" format.
+            display_out (ndarray | None): Destination of the display frame,
+                skipped if None.
+            stdet_out (ndarray | None): Destination of the stdet input frame,
+                skipped if None.
+        """
+        if display_out is not None and stdet_out is not None:
+            if self.display_larger:
+                mmcv.imresize(frame, self.display_size, out=display_out)
+                mmcv.imresize(display_out, self.stdet_input_size, out=stdet_out)
+            else:
+                mmcv.imresize(frame, self.stdet_input_size, out=stdet_out)
+                mmcv.imresize(stdet_out, self.display_size, out=display_out)
+        elif display_out is not None:
+            mmcv.imresize(frame, self.display_size, out=display_out)
+        elif stdet_out is not None:
+            mmcv.imresize(frame, self.stdet_input_size, out=stdet_out)
+
     def display_fn(self):
         """Main function for display thread.
 
@@ -527,24 +1281,19 @@ class ClipHelper:
                 read_id = self.read_id
                 not_end = self.not_end
 
-            with self.display_lock:
-                # If video ended and we have display all frames.
-                if not not_end and self.display_id == read_id:
-                    break
+            # If video ended and we have display all frames.
+            if not not_end and self.display_queue.next_id > read_id:
+                break
 
-                # If the next task are not available, wait.
-                if (
-                    len(self.display_queue) == 0
-                    or self.display_queue.get(self.display_id + 1) is None
-                ):
-                    time.sleep(0.02)
-                    continue
+            # Wait for the next task in order. Tasks which take too long
+            # are skipped by the reorder buffer.
+            entry = self.display_queue.get(timeout=0.5)
+            if entry is None:
+                continue
 
-                # get display data and update state
-                self.display_id += 1
-                was_read, task = self.display_queue[self.display_id]
-                del self.display_queue[self.display_id]
-                display_id = self.display_id
+            # get display data and update state
+            self.display_id, (was_read, task) = entry
+            display_id = self.display_id
 
             # do display predictions
             with self.output_lock:
@@ -558,17 +1307,27 @@ class ClipHelper:
                     cur_display_inds = self.display_inds
 
                 for frame_id in cur_display_inds:
+                    if not self.planner.is_shown(task.frames_start + frame_id):
+                        continue
                     frame = task.frames[frame_id]
                     if self.show:
-                        cv2.imshow("Demo", frame)
-                        cv2.waitKey(int(1000 / self.output_fps))
+                        cv2.imshow(self.window_name, frame)
+                        cv2.waitKey(int(1000 / self.display_fps))
                     if self.video_writer:
                         self.video_writer.write(frame)
 
+            self.release((was_read, task))
+
             cur_time = time.time()
+            with self.read_id_lock:
+                read_id = self.read_id
             logger.debug(
                 f"Display thread: {1000*(cur_time - start_time):.0f} ms, "
-                f"read id {read_id}, display id {display_id}"
+                f"latency {1000*(cur_time - task.read_time):.0f} ms, "
+                f"read id {read_id}, display id {display_id}, "
+                f"pending {len(self.display_queue)}, "
+                f"skipped {self.display_queue.skipped}, "
+                f"late {self.display_queue.late}"
             )
             start_time = cur_time
 
@@ -578,21 +1337,21 @@ class ClipHelper:
     def __next__(self):
         """Get data from read queue.
 
-        This function is part of the main thread.
+        This function is part of the main thread. Blocks until a task is
+        available or a short timeout expires.
         """
-        if self.read_queue.qsize() == 0:
-            time.sleep(0.02)
+        try:
+            was_read, task = self.read_queue.get(timeout=0.1)
+        except queue.Empty:
             return not self.stopped, None
 
-        was_read, task = self.read_queue.get()
         if not was_read:
             # If we reach the end of the video, there aren't enough frames
             # in the task.processed_frames, so no need to model inference
             # and draw predictions. Put task into display queue.
             with self.read_id_lock:
                 read_id = self.read_id
-            with self.display_lock:
-                self.display_queue[read_id] = was_read, copy.deepcopy(task)
+            self.display_queue.put(read_id, (was_read, task), timed=False)
 
             # main thread doesn't need to handle this task again
             task = None
@@ -600,12 +1359,16 @@ class ClipHelper:
 
     def start(self):
         """Start read thread and display thread."""
+        suffix = "" if self.area_id is None else f"-{self.area_id}"
         self.read_thread = threading.Thread(
-            target=self.read_fn, args=(), name="VidRead-Thread", daemon=True
+            target=self.read_fn, args=(), name=f"VidRead-Thread{suffix}", daemon=True
         )
         self.read_thread.start()
         self.display_thread = threading.Thread(
-            target=self.display_fn, args=(), name="VidDisplay-Thread", daemon=True
+            target=self.display_fn,
+            args=(),
+            name=f"VidDisplay-Thread{suffix}",
+            daemon=True,
         )
         self.display_thread.start()
 
@@ -614,6 +1377,9 @@ class ClipHelper:
     def clean(self):
         """Close all threads and release all resources."""
         self.stopped = True
+        self.frame_buffer.close()
+        self.read_queue.close()
+        self.display_queue.close()
         self.read_lock.acquire()
         self.cap.release()
         self.read_lock.release()
@@ -635,8 +1401,23 @@ class ClipHelper:
             task (TaskInfo object): task object that contain the necessary
             information for prediction visualization.
         """
-        with self.display_lock:
-            self.display_queue[task.id] = (True, task)
+        self.display_queue.put(task.id, (True, task))
+
+    def release(self, item):
+        """Drop the references of a displayed or late task to shared frames."""
+        _, task = item
+        self.frame_buffer.release(task.frames_start, len(task.frames))
+
+    def skip(self, item):
+        """Send a task dropped from the read queue straight to display.
+
+        The frames are shown without predictions, so the output video stays
+        complete and the display order is kept. The task is put untimed, it
+        must not make the clips before it that are still in inference look
+        late.
+        """
+        _, task = item
+        self.display_queue.put(task.id, (True, task), timed=False)
 
     def detect(self, task):
         if task.action_preds is not None:
@@ -649,7 +1430,8 @@ class ClipHelper:
         self.detect(task)
         if self.cnt != 0 and self.cnt % 9 == 0:
             # cv2.imwrite("./static/"+str(now)+".jpg", task.frames[self.display_inds[0]])
-            cv2.imwrite("./static/drowning.jpg", task.frames[self.display_inds[0]])
+            cv2.imwrite(self.alert_path, task.frames[self.display_inds[0]])
+            logger.info(f"Drowning detected in area {self.area_id}")
             self.cnt = 0
 
     def get_output_video_writer(self, path):
@@ -661,7 +1443,7 @@ class ClipHelper:
         return cv2.VideoWriter(
             filename=path,
             fourcc=cv2.VideoWriter_fourcc(*"mp4v"),
-            fps=float(self.output_fps),
+            fps=float(self.display_fps),
             frameSize=self.display_size,
             isColor=True,
         )
@@ -702,9 +1484,11 @@ class BaseVisualizer(metaclass=ABCMeta):
         right_frames = frames[draw_range[1] + 1 :]
         draw_frames = frames[draw_range[0] : draw_range[1] + 1]
 
-        # get labels(texts) and draw predictions
+        # get labels(texts) and draw predictions, frames are shared with other
+        # tasks so draw on copies
         draw_frames = [
-            self.draw_one_image(frame, bboxes, preds) for frame in draw_frames
+            self.draw_one_image(frame.copy(), bboxes, preds)
+            for frame in draw_frames
         ]
 
         return list(left_frames) + draw_frames + list(right_frames)
@@ -746,6 +1530,8 @@ class DefaultVisualizer(BaseVisualizer):
             Default: 1.
         text_linetype (int): LInetype from OpenCV for texts.
             Default: 1.
+        draw_unlabeled (bool): Whether to draw bboxes without predictions.
+            Default: True.
     """
 
     def __init__(
@@ -757,8 +1543,10 @@ class DefaultVisualizer(BaseVisualizer):
         text_fontcolor=(255, 255, 255),  # white
         text_thickness=1,
         text_linetype=1,
+        draw_unlabeled=True,
     ):
         super().__init__(max_labels_per_bbox=max_labels_per_bbox)
+        self.draw_unlabeled = draw_unlabeled
         self.text_fontface = text_fontface
         self.text_fontscale = text_fontscale
         self.text_fontcolor = text_fontcolor
@@ -775,6 +1563,9 @@ class DefaultVisualizer(BaseVisualizer):
     def draw_one_image(self, frame, bboxes, preds):
         """Draw predictions on one image."""
         for bbox, pred in zip(bboxes, preds):
+            if not pred and not self.draw_unlabeled:
+                continue
+
             # draw bbox
             box = bbox.astype(np.int64)
             st, ed = tuple(box[:2]), tuple(box[2:])
@@ -807,11 +1598,46 @@ class DefaultVisualizer(BaseVisualizer):
         return frame
 
 
+def get_stream_filename(filename, area_id):
+    """Add the area id to the output filename of one of several streams."""
+    if filename is None or area_id is None:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}_{area_id}{ext}"
+
+
 def main(args):
+    start_time = time.time()
+    model_loader = ModelLoader(args.model_cache or None)
+    if args.quantized:
+        assert args.device == "cpu", "int8 models run on CPU"
+        assert args.input_dtype == "float32", "int8 models take float32"
+
     # init human detector
-    human_detector = MmdetHumanDetector(
-        args.det_config, args.det_checkpoint, args.device, args.det_score_thr
-    )
+    if args.backend == "onnxruntime":
+        human_detector = OnnxHumanDetector(
+            args.det_config,
+            args.det_onnx,
+            args.det_score_thr,
+            num_threads=args.ort_threads,
+        )
+    else:
+        human_detector = MmdetHumanDetector(
+            args.det_config,
+            args.det_checkpoint,
+            args.device,
+            args.det_score_thr,
+            quantized=args.quantized,
+            loader=model_loader,
+        )
+    if args.detect_interval > 1 or args.stdet_safe_thr > 0:
+        # the stdet cache needs track ids, even when detecting every clip
+        human_detector = TrackingHumanDetector(
+            human_detector,
+            args.detect_interval,
+            min_confidence=args.track_min_conf,
+            decay=args.track_decay,
+        )
 
     # init action detector
     config = Config.fromfile(args.config)
@@ -823,39 +1649,172 @@ def main(args):
         config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
     except KeyError:
         pass
-    stdet_predictor = StdetPredictor(
-        config=config,
-        checkpoint=args.checkpoint,
-        device=args.device,
-        score_thr=args.action_score_thr,
-        label_map_path=args.label_map,
-    )
-
-    # init clip helper
-    clip_helper = ClipHelper(
-        config=config,
-        display_height=args.display_height,
-        display_width=args.display_width,
-        input_video=args.input_video,
-        predict_stepsize=args.predict_stepsize,
-        output_fps=args.output_fps,
-        clip_vis_length=args.clip_vis_length,
-        out_filename=args.out_filename,
-        show=args.show,
-    )
+    stdet_cache = None
+    if args.stdet_safe_thr > 0:
+        stdet_cache = TrackScoreCache(
+            args.stdet_safe_thr, interval=args.stdet_safe_interval
+        )
+    if args.stdet_server:
+        assert args.stdet_authkey, f"set ${AUTHKEY_ENV} or --stdet-authkey"
+        stdet_predictor = RemoteStdetPredictor(
+            address=args.stdet_server,
+            authkey=args.stdet_authkey,
+            config=config,
+            score_thr=args.action_score_thr,
+            label_map_path=args.label_map,
+            cache=stdet_cache,
+            top_k=args.max_labels_per_bbox,
+        )
+    elif args.backend == "onnxruntime":
+        assert args.input_dtype == "float32", "the onnx backbone takes float32"
+        stdet_predictor = OnnxStdetPredictor(
+            config=config,
+            checkpoint=args.checkpoint,
+            onnx_file=args.stdet_onnx,
+            score_thr=args.action_score_thr,
+            label_map_path=args.label_map,
+            num_threads=args.ort_threads,
+            cache=stdet_cache,
+            top_k=args.max_labels_per_bbox,
+        )
+    else:
+        stdet_predictor = StdetPredictor(
+            config=config,
+            checkpoint=args.checkpoint,
+            device=args.device,
+            score_thr=args.action_score_thr,
+            label_map_path=args.label_map,
+            fp16=args.input_dtype == "float16",
+            cache=stdet_cache,
+            top_k=args.max_labels_per_bbox,
+            quantized=args.quantized,
+            loader=model_loader,
+        )
+
+    first_prediction = threading.Event()
 
     # init visualizer
-    vis = DefaultVisualizer()
+    vis = DefaultVisualizer(max_labels_per_bbox=args.max_labels_per_bbox)
+
+    def output(task):
+        clip_helper = clip_helpers[task.area_id]
+        if not first_prediction.is_set():
+            first_prediction.set()
+            logger.info(f"Time to first prediction {time.time() - start_time:.1f} s")
+
+        # draw stdet predictions in raw frames
+        vis.draw_predictions(task)
+        logger.info(f"Stdet Results of area {task.area_id}: {task.action_preds}")
+
+        # detect drawning frame, before the display thread releases the
+        # task's frames
+        clip_helper.detect_drowning(task)
+
+        # add draw frames to display queue
+        clip_helper.display(task)
+        logger.debug(
+            f"Inference latency {1000*(time.time() - task.read_time):.0f} ms"
+        )
 
-    # start read and display thread
-    clip_helper.start()
+    # Each stage runs in its own threads, so human detection of clip n + 1
+    # overlaps stdet of clip n and drawing of clip n - 1. Keyframes of
+    # several clips and cameras are detected in batches. Clips finished out
+    # of order by parallel workers are reordered before display.
+    stages = [
+        Stage(
+            "Detect",
+            human_detector.predict_batch,
+            num_workers=args.detect_workers,
+            batch_size=args.detect_batch_size,
+            batch_timeout=args.detect_batch_timeout,
+        ),
+        Stage("Stdet", stdet_predictor.predict, num_workers=args.stdet_workers),
+        Stage("Output", output),
+    ]
+    if args.record_clips:
+        recorder = ClipRecorder(args.record_clips, args.record_max_clips)
+        stages.insert(1, Stage("Record", recorder.record))
+    pipeline = StagePipeline(
+        stages,
+        queue_size=args.stage_queue_size,
+        # free the frames of tasks thrown away after a stage failed, so the
+        # read threads never wait for them
+        on_discard=lambda task: clip_helpers[task.area_id].release((True, task)),
+    )
 
-    try:
-        # Main thread main function contains:
-        # 1) get data from read queue
-        # 2) get human bboxes and stdet predictions
-        # 3) draw stdet predictions and update task
-        # 4) put task into display queue
+    # init one clip helper per camera, all of them share the models above
+    if args.sources:
+        sources = [source.split("=", 1) for source in args.sources]
+        sources = [(int(area_id), input_video) for area_id, input_video in sources]
+    else:
+        sources = [(None, args.input_video)]
+    # every display thread would call cv2.imshow, and HighGUI is not thread
+    # safe, so windows are only shown for a single stream
+    assert not (args.show and len(sources) > 1), "--show supports one source only"
+    # clips holding ring buffer frames at the same time: the read queue, the
+    # pipeline, a feed thread blocked in `put`, the display reorder window
+    # and the clip on display. With fewer, the reader would wait for frames
+    # before the read queue is full, so drop policies could never fire.
+    # Clips only finish out of order with parallel workers, and never more
+    # of them than the pipeline holds.
+    reorder_clips = 0
+    if any(stage.num_workers > 1 for stage in pipeline.stages):
+        reorder_clips = pipeline.capacity
+        if args.reorder_window > 0:
+            reorder_clips = min(args.reorder_window, reorder_clips)
+    needed_clips = (
+        max(args.read_queue_size, 0) + pipeline.capacity + 1 + reorder_clips + 1
+    )
+    frame_buffer_clips = args.frame_buffer_clips
+    if frame_buffer_clips <= 0:
+        frame_buffer_clips = needed_clips
+    if args.read_queue_policy != "block":
+        assert args.read_queue_size > 0, "drop policies need a bounded read queue"
+        assert frame_buffer_clips >= needed_clips, (
+            f"--frame-buffer-clips must be at least {needed_clips} for "
+            f"--read-queue-policy {args.read_queue_policy} to drop clips"
+        )
+    clip_helpers = {}
+    for area_id, input_video in sources:
+        clip_helpers[area_id] = ClipHelper(
+            config=config,
+            display_height=args.display_height,
+            display_width=args.display_width,
+            input_video=input_video,
+            predict_stepsize=args.predict_stepsize,
+            output_fps=args.output_fps,
+            clip_vis_length=args.clip_vis_length,
+            out_filename=get_stream_filename(args.out_filename, area_id),
+            show=args.show,
+            frame_buffer_clips=frame_buffer_clips,
+            read_queue_size=args.read_queue_size,
+            read_queue_policy=args.read_queue_policy,
+            max_speed=args.max_speed,
+            input_dtype=np.dtype(args.input_dtype),
+            reorder_window=args.reorder_window,
+            reorder_timeout=args.reorder_timeout,
+            area_id=area_id,
+        )
+
+    # pay lazy init costs before frames flow
+    model_loader.clear()
+    logger.info(f"Models loaded in {time.time() - start_time:.1f} s")
+    if args.warmup > 0:
+        warmup_time = time.time()
+        clip_helper = next(iter(clip_helpers.values()))
+        display_w, display_h = clip_helper.display_size
+        human_detector.warmup((display_h, display_w, 3), args.warmup)
+        stdet_predictor.warmup(
+            clip_helper.blank_model_inputs(stdet_predictor.device), args.warmup
+        )
+        logger.info(f"Warmup took {time.time() - warmup_time:.1f} s")
+
+    def feed(clip_helper):
+        # Feed thread main function contains:
+        # 1) get data from read queue of one camera
+        # 2) put task into the shared pipeline, which gets human bboxes and
+        #    stdet predictions, draws stdet predictions and puts task into
+        #    display queue of the camera
         for able_to_read, task in clip_helper:
             # get data from read queue
 
@@ -864,40 +1823,45 @@ def main(args):
                 break
 
             if task is None:
-                # when no data in read queue, wait
-                time.sleep(0.01)
+                if pipeline.failed.is_set():
+                    break
+                # no data in read queue before the timeout, try again
                 continue
 
-            inference_start = time.time()
-
-            # get human bboxes
-            human_detector.predict(task)
-
-            # get stdet predictions
-            stdet_predictor.predict(task)
-
-            # draw stdet predictions in raw frames
-            vis.draw_predictions(task)
-            logger.info(f"Stdet Results: {task.action_preds}")
-
-            # add draw frames to display queue
-            clip_helper.display(task)
-
-            # detect drawning frame
-            clip_helper.detect_drowning(task)
+            if not pipeline.put(task):
+                # a stage failed and the task was discarded, stop feeding so
+                # the main thread raises the error
+                break
 
-            logger.debug(
-                "Main thread inference time "
-                f"{1000*(time.time() - inference_start):.0f} ms"
+    # start read, display, feed and inference threads
+    feed_threads = []
+    for area_id, clip_helper in clip_helpers.items():
+        clip_helper.start()
+        feed_threads.append(
+            threading.Thread(
+                target=feed,
+                args=(clip_helper,),
+                name=f"Feed-Thread-{area_id}",
+                daemon=True,
             )
+        )
+    pipeline.start()
+    for thread in feed_threads:
+        thread.start()
 
-        # wait for display thread
-        clip_helper.join()
+    try:
+        # wait for feed, inference and display threads
+        for thread in feed_threads:
+            thread.join()
+        pipeline.join()
+        for clip_helper in clip_helpers.values():
+            clip_helper.join()
     except KeyboardInterrupt:
         pass
     finally:
         # close read & display thread, release all resources
-        clip_helper.clean()
+        for clip_helper in clip_helpers.values():
+            clip_helper.clean()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+"""onnxruntime helpers shared by `onnx_export.py` and the demo backends."""
+import os
+
+import torch
+import torch.nn as nn
+from mmdet.datasets import replace_ImageToTensor
+from mmdet.datasets.pipelines import Compose
+
+try:
+    import onnxruntime as ort
+except (ImportError, ModuleNotFoundError):
+    ort = None
+
+try:
+    from mmcv.ops import get_onnxruntime_op_path
+except (ImportError, ModuleNotFoundError):
+    get_onnxruntime_op_path = None
+
+
+def create_session(onnx_file, num_threads=0):
+    """Create a CPU onnxruntime session.
+
+    The mmcv custom op library, needed by detectors exported with RoIAlign
+    and NMS, is registered when mmcv has been built with it.
+
+    Args:
+        onnx_file (str): Path to the ONNX graph.
+        num_threads (int): Intra-op threads, <= 0 keeps the default.
+            Default: 0.
+    """
+    if ort is None:
+        raise ImportError(
+            "Failed to import `onnxruntime`, install it with "
+            "`pip install onnxruntime` to use the onnxruntime backend"
+        )
+    options = ort.SessionOptions()
+    if num_threads > 0:
+        options.intra_op_num_threads = num_threads
+    if get_onnxruntime_op_path is not None:
+        op_path = get_onnxruntime_op_path()
+        if op_path and os.path.exists(op_path):
+            options.register_custom_ops_library(op_path)
+    return ort.InferenceSession(
+        onnx_file, options, providers=["CPUExecutionProvider"]
+    )
+
+
+class StdetBackbone(nn.Module):
+    """Feature extractor of a stdet model, the part exported to ONNX.
+
+    The RoI head is cheap, only accepts one clip in test mode and relies on
+    mmcv RoI ops, so it stays in PyTorch.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, img):
+        feats = self.model.extract_feat(img)
+        return feats if isinstance(feats, tuple) else (feats,)
+
+
+def backbone_outputs(session, img):
+    """Run an exported stdet backbone, return features like `extract_feat`."""
+    feats = session.run(None, {"img": img})
+    feats = tuple(torch.from_numpy(feat) for feat in feats)
+    return feats if len(feats) > 1 else feats[0]
+
+
+class DetectorPreprocessor:
+    """The test pipeline of an mmdet config, like `inference_detector`.
+
+    Args:
+        config (Config): mmdet config.
+    """
+
+    def __init__(self, config):
+        config = config.copy()
+        config.data.test.pipeline[0].type = "LoadImageFromWebcam"
+        self.pipeline = Compose(replace_ImageToTensor(config.data.test.pipeline))
+
+    def __call__(self, image):
+        """Return the (1, 3, h, w) detector input and its image meta."""
+        data = self.pipeline(dict(img=image))
+        return data["img"][0].unsqueeze(0).numpy(), data["img_metas"][0].data
+
+
+def detector_outputs(session, img, meta):
+    """Run an exported mmdet detector on one preprocessed image.
+
+    Returns:
+        tuple: [n, 5] bboxes and scores in pixels of the original image, and
+            the [n] class labels.
+    """
+    dets, labels = session.run(None, {"input": img})
+    dets = dets[0].copy()
+    dets[:, :4] /= meta["scale_factor"]
+    return dets, labels[0]
@@ -0,0 +1,330 @@
+"""Export the stdet and human detector models to ONNX and check them.
+
+The stdet backbone and the whole mmdet detector are exported. The stdet
+RoI head stays in PyTorch, see `onnx_backend.StdetBackbone`. After export
+both graphs are compared with the PyTorch models on CPU: max output
+differences and mean latency are printed, and saved with `--report`.
+
+Example:
+    python onnx_export.py --records demo/records --det-image pool.jpg
+    python my_webcam_demo_spatiotemporal_det.py --backend onnxruntime
+"""
+import argparse
+import json
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+import torch
+from mmcv import Config, DictAction
+from mmcv.runner import load_checkpoint
+
+from mmaction.models import build_detector
+
+from clip_records import load_records
+from onnx_backend import (
+    DetectorPreprocessor,
+    StdetBackbone,
+    backbone_outputs,
+    create_session,
+    detector_outputs,
+)
+from tracker import bbox_iou, greedy_match
+
+try:
+    from mmdet.apis import inference_detector, init_detector
+except (ImportError, ModuleNotFoundError):
+    raise ImportError(
+        "Failed to import `inference_detector` and "
+        "`init_detector` form `mmdet.apis`. These apis are "
+        "required in this tool! "
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export demo models to ONNX")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["stdet", "det"],
+        choices=("stdet", "det"),
+        help="models to export",
+    )
+    parser.add_argument(
+        "--config",
+        default=("stdet_model/my_slowfast_kinetics_pretrained_r50_4x16x1_200e_ava.py"),
+        help="spatio temporal detection config file path",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=("stdet_model/my_stdet.pth"),
+        help="spatio temporal detection checkpoint file/url",
+    )
+    parser.add_argument(
+        "--stdet-onnx",
+        default="stdet_model/my_stdet_backbone.onnx",
+        help="output ONNX file of the stdet backbone",
+    )
+    parser.add_argument(
+        "--stdet-input-shape",
+        nargs=2,
+        type=int,
+        default=[256, 455],
+        help="height and width of the stdet input used for tracing, the "
+        "graph accepts any size",
+    )
+    parser.add_argument(
+        "--det-config",
+        default="stdet_model/my_faster_rcnn_r50_fpn_2x_coco.py",
+        help="human detection config file path (from mmdet)",
+    )
+    parser.add_argument(
+        "--det-checkpoint",
+        default=("stdet_model/my_mmdet.pth"),
+        help="human detection checkpoint file/url",
+    )
+    parser.add_argument(
+        "--det-onnx",
+        default="stdet_model/my_mmdet.onnx",
+        help="output ONNX file of the human detector",
+    )
+    parser.add_argument(
+        "--det-input-shape",
+        nargs=2,
+        type=int,
+        default=[800, 1344],
+        help="height and width of the detector input used for tracing",
+    )
+    parser.add_argument(
+        "--det-score-thr",
+        type=float,
+        default=0.8,
+        help="the threshold of human detection score",
+    )
+    parser.add_argument(
+        "--records",
+        default=None,
+        help="folder of clips recorded with --record-clips to check the stdet "
+        "graph on, random inputs are used otherwise",
+    )
+    parser.add_argument(
+        "--max-clips", default=8, type=int, help="max number of recorded clips"
+    )
+    parser.add_argument(
+        "--det-image",
+        default=None,
+        help="image or video, whose first frame is used, to check the "
+        "detector graph on",
+    )
+    parser.add_argument(
+        "--repeat", default=10, type=int, help="number of runs to time"
+    )
+    parser.add_argument(
+        "--num-threads",
+        default=0,
+        type=int,
+        help="CPU threads of both PyTorch and onnxruntime, <= 0 keeps the "
+        "defaults",
+    )
+    parser.add_argument("--opset", default=11, type=int, help="ONNX opset version")
+    parser.add_argument("--report", default=None, help="output json report")
+    parser.add_argument(
+        "--cfg-options",
+        nargs="+",
+        action=DictAction,
+        default={},
+        help="override some settings in the used stdet config, the key-value "
+        "pair in xxx=yyy format will be merged into config file",
+    )
+    return parser.parse_args()
+
+
+def timeit(fn, repeat):
+    """Mean milliseconds of `fn()` after one warmup call."""
+    fn()
+    start_time = time.time()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.time() - start_time) / repeat
+
+
+def export_stdet(args):
+    config = Config.fromfile(args.config)
+    config.merge_from_dict(args.cfg_options)
+    try:
+        # different actions should have the same number of bboxes
+        config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
+    except KeyError:
+        pass
+    config.model.backbone.pretrained = None
+    model = build_detector(config.model, test_cfg=config.get("test_cfg"))
+    load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.eval()
+    backbone = StdetBackbone(model)
+
+    if args.records:
+        samples = [
+            inputs for _, inputs in load_records(args.records, "cpu", args.max_clips)
+        ]
+    else:
+        sampler = [
+            x for x in config.data.val.pipeline if x["type"] == "SampleAVAFrames"
+        ][0]
+        h, w = args.stdet_input_shape
+        samples = [
+            dict(
+                return_loss=False,
+                img=[torch.randn(1, 3, sampler["clip_len"], h, w)],
+                proposals=[[torch.tensor([[0.0, 0.0, w - 1.0, h - 1.0]])]],
+                img_metas=[[dict(img_shape=(h, w))]],
+            )
+        ]
+
+    img = samples[0]["img"][0]
+    with torch.no_grad():
+        num_feats = len(backbone(img))
+    feat_names = [f"feat{idx}" for idx in range(num_feats)]
+    dynamic_axes = {"img": {0: "batch", 3: "height", 4: "width"}}
+    dynamic_axes.update(
+        {name: {0: "batch", 3: "height", 4: "width"} for name in feat_names}
+    )
+    torch.onnx.export(
+        backbone,
+        (img,),
+        args.stdet_onnx,
+        input_names=["img"],
+        output_names=feat_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=args.opset,
+        do_constant_folding=True,
+    )
+    print(f"Saved stdet backbone to {args.stdet_onnx}")
+
+    # parity and latency
+    session = create_session(args.stdet_onnx, args.num_threads)
+    feat_diff, score_diff = 0.0, 0.0
+    with torch.no_grad():
+        for inputs in samples:
+            img = inputs["img"][0]
+            torch_feats = backbone(img)
+            ort_feats = backbone_outputs(session, img.numpy())
+            if num_feats == 1:
+                # a single feature map is passed to the RoI head unwrapped
+                torch_feats = torch_feats[0]
+                diff = (torch_feats - ort_feats).abs().max().item()
+                feat_diff = max(feat_diff, diff)
+            else:
+                for torch_feat, ort_feat in zip(torch_feats, ort_feats):
+                    diff = (torch_feat - ort_feat).abs().max().item()
+                    feat_diff = max(feat_diff, diff)
+
+            results = [
+                model.roi_head.simple_test(
+                    x, inputs["proposals"][0], inputs["img_metas"][0], rescale=False
+                )[0]
+                for x in (torch_feats, ort_feats)
+            ]
+            for torch_res, ort_res in zip(*results):
+                if len(torch_res):
+                    score_diff = max(
+                        score_diff, np.abs(torch_res[:, 4] - ort_res[:, 4]).max()
+                    )
+
+        img = samples[0]["img"][0]
+        torch_ms = timeit(lambda: backbone(img), args.repeat)
+        ort_ms = timeit(lambda: session.run(None, {"img": img.numpy()}), args.repeat)
+    return dict(
+        num_clips=len(samples),
+        max_feature_diff=float(feat_diff),
+        max_score_diff=float(score_diff),
+        pytorch_backbone_ms=torch_ms,
+        onnxruntime_backbone_ms=ort_ms,
+    )
+
+
+def export_det(args):
+    model = init_detector(args.det_config, args.det_checkpoint, device="cpu")
+    h, w = args.det_input_shape
+    meta = dict(
+        img_shape=(h, w, 3),
+        ori_shape=(h, w, 3),
+        pad_shape=(h, w, 3),
+        scale_factor=np.ones(4, dtype=np.float32),
+        flip=False,
+        flip_direction=None,
+        filename="<export>",
+        ori_filename="<export>",
+        show_img=None,
+    )
+    forward = model.forward
+    model.forward = partial(
+        forward, img_metas=[[meta]], return_loss=False, rescale=False
+    )
+    torch.onnx.export(
+        model,
+        [torch.randn(1, 3, h, w)],
+        args.det_onnx,
+        input_names=["input"],
+        output_names=["dets", "labels"],
+        dynamic_axes={
+            "input": {0: "batch", 2: "height", 3: "width"},
+            "dets": {0: "batch", 1: "num_dets"},
+            "labels": {0: "batch", 1: "num_dets"},
+        },
+        opset_version=args.opset,
+        do_constant_folding=True,
+        keep_initializers_as_inputs=True,
+    )
+    model.forward = forward
+    print(f"Saved human detector to {args.det_onnx}")
+
+    # parity and latency on person bboxes
+    if args.det_image is None:
+        print("No --det-image, checking the detector on noise")
+        image = np.random.randint(0, 256, (480, 640, 3), dtype=np.uint8)
+    else:
+        cap = cv2.VideoCapture(args.det_image)
+        was_read, image = cap.read()
+        cap.release()
+        assert was_read, f"Failed to read {args.det_image}"
+    preprocess = DetectorPreprocessor(model.cfg)
+    session = create_session(args.det_onnx, args.num_threads)
+
+    def run_torch():
+        bboxes = inference_detector(model, image)[0]
+        return bboxes[bboxes[:, 4] >= args.det_score_thr]
+
+    def run_ort():
+        dets, labels = detector_outputs(session, *preprocess(image))
+        return dets[(labels == 0) & (dets[:, 4] >= args.det_score_thr)]
+
+    torch_dets, ort_dets = run_torch(), run_ort()
+    matches = greedy_match(bbox_iou(torch_dets[:, :4], ort_dets[:, :4]), 0.5)
+    diffs = [np.abs(torch_dets[i] - ort_dets[j]).max() for i, j in matches]
+    return dict(
+        pytorch_bboxes=len(torch_dets),
+        onnxruntime_bboxes=len(ort_dets),
+        matched_bboxes=len(matches),
+        max_bbox_diff=float(max(diffs, default=0.0)),
+        pytorch_ms=timeit(run_torch, args.repeat),
+        onnxruntime_ms=timeit(run_ort, args.repeat),
+    )
+
+
+def main(args):
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    report = {}
+    if "stdet" in args.models:
+        report["stdet"] = export_stdet(args)
+    if "det" in args.models:
+        report["det"] = export_det(args)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(parse_args())
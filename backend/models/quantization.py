@@ -0,0 +1,147 @@
+"""Post-training INT8 quantization of the stdet model and the human detector.
+
+Two modes, both run on CPU only:
+
+1) dynamic: int8 weights for Linear layers, activations are quantized on
+    the fly. Needs no calibration, but only covers the fc layers of the
+    detector bbox head, the stdet model is nearly all Conv3d.
+2) static: int8 weights and activations for Conv and Linear layers, with
+    activation ranges calibrated on real inputs. BatchNorm is folded into
+    the preceding conv first. Every layer is wrapped in its own quant and
+    dequant stubs, so the mmcv / mmaction modules around it, residual adds
+    and RoI ops included, keep running in float.
+
+The final classifiers in `FLOAT_LAYERS` stay in float, they are tiny and
+drive the scores directly.
+
+Quantized models are saved as state dicts with the mode in their meta, and
+loaded by applying the same conversion to a freshly built model.
+"""
+import torch
+import torch.nn as nn
+from torch.nn.modules.batchnorm import _BatchNorm
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+QUANT_MODES = ("dynamic", "static")
+FLOAT_LAYERS = ("roi_head.bbox_head.fc_cls", "roi_head.bbox_head.fc_reg")
+
+
+def fuse_conv_bn(module):
+    """Fold every BatchNorm into the conv registered right before it."""
+    last_conv, last_conv_name = None, None
+    for name, child in module.named_children():
+        if isinstance(child, _BatchNorm) and last_conv is not None:
+            module._modules[last_conv_name] = fuse_conv_bn_eval(last_conv, child)
+            module._modules[name] = nn.Identity()
+            last_conv = None
+        elif isinstance(child, (nn.Conv2d, nn.Conv3d)):
+            last_conv, last_conv_name = child, name
+        else:
+            fuse_conv_bn(child)
+    return module
+
+
+def _plain_layer(layer):
+    """Cast a layer to its torch base class, which quantization maps.
+
+    mmcv registers subclasses of the torch layers that only differ for
+    empty inputs, which never reach quantized layers.
+    """
+    for cls in (nn.Conv2d, nn.Conv3d, nn.Linear):
+        if isinstance(layer, cls):
+            break
+    layer.__class__ = cls
+    return layer
+
+
+def _target_layers(model, types, skip):
+    return [
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, types)
+        and not any(name == prefix or name.startswith(prefix + ".") for prefix in skip)
+    ]
+
+
+def _set_module(model, name, module):
+    parent_name, _, child_name = name.rpartition(".")
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+
+def quantize_model(model, mode, skip=FLOAT_LAYERS, calibrate=None):
+    """Quantize a float model in place for CPU inference.
+
+    Args:
+        model (nn.Module): Model in eval mode, on CPU.
+        mode (str): One of `QUANT_MODES`.
+        skip (tuple[str]): Names of layers kept in float, with their
+            children. Default: `FLOAT_LAYERS`.
+        calibrate (callable, optional): Called with the prepared model to
+            run calibration inputs through it, only used by 'static'.
+            Default: None, leaving default activation ranges, which is only
+            meant for loading a quantized state dict afterwards.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    if mode == "dynamic":
+        names = _target_layers(model, nn.Linear, skip)
+        for name in names:
+            _set_module(model, name, _plain_layer(model.get_submodule(name)))
+        return torch.quantization.quantize_dynamic(
+            model,
+            {name: torch.quantization.default_dynamic_qconfig for name in names},
+            inplace=True,
+        )
+    if mode != "static":
+        raise ValueError(f"Unknown quantization mode {mode}, choose from {QUANT_MODES}")
+
+    fuse_conv_bn(model)
+    qconfig = torch.quantization.get_default_qconfig(
+        torch.backends.quantized.engine
+    )
+    for name in _target_layers(model, (nn.Conv2d, nn.Conv3d, nn.Linear), skip):
+        wrapper = torch.quantization.QuantWrapper(
+            _plain_layer(model.get_submodule(name))
+        )
+        wrapper.qconfig = qconfig
+        _set_module(model, name, wrapper)
+    torch.quantization.prepare(model, inplace=True)
+    if calibrate is not None:
+        with torch.no_grad():
+            calibrate(model)
+    return torch.quantization.convert(model, inplace=True)
+
+
+def save_quantized(model, path, mode, skip=FLOAT_LAYERS, **meta):
+    """Save a quantized model with what `load_quantized` needs."""
+    meta = dict(
+        quantized=mode,
+        skip=list(skip),
+        engine=torch.backends.quantized.engine,
+        **meta,
+    )
+    torch.save(dict(state_dict=model.state_dict(), meta=meta), path)
+
+
+def load_quantized(model, path):
+    """Quantize a freshly built float model and load a saved quantized one.
+
+    Args:
+        model (nn.Module): Float model built from the same config.
+        path (str): File written by `save_quantized`.
+
+    Returns:
+        dict: Meta of the saved model.
+    """
+    checkpoint = torch.load(path, map_location="cpu")
+    meta = checkpoint["meta"]
+    assert "quantized" in meta, f"{path} is not a quantized checkpoint"
+    # packed int8 weights are laid out for the engine they were calibrated on
+    if meta["engine"] in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = meta["engine"]
+    model.cpu().eval()
+    quantize_model(model, meta["quantized"], skip=tuple(meta["skip"]))
+    model.load_state_dict(checkpoint["state_dict"])
+    return meta
@@ -0,0 +1,301 @@
+"""Calibrate and save INT8 versions of the stdet model and human detector.
+
+Models are quantized with `quantization.quantize_model` on clips recorded
+with `--record-clips`. The first `--calib-clips` clips calibrate static
+quantization, the remaining ones measure what it costs. The detector sees
+the recorded display keyframe of each clip, like at runtime.
+
+The report compares the float and int8 models on CPU: action score
+differences and label agreement at `--action-score-thr` for stdet, matched
+person bboxes for the detector, and mean latency of both.
+
+Example:
+    python quantize.py --records demo/records --mode static
+    python my_webcam_demo_spatiotemporal_det.py --quantized \\
+        --checkpoint stdet_model/my_stdet_int8.pth \\
+        --det-checkpoint stdet_model/my_mmdet_int8.pth
+"""
+import argparse
+import copy
+import json
+import os
+
+import numpy as np
+import torch
+from mmcv import Config, DictAction
+from mmcv.runner import load_checkpoint
+
+from mmaction.models import build_detector
+
+from clip_records import load_keyframes, load_records
+from onnx_export import timeit
+from quantization import QUANT_MODES, quantize_model, save_quantized
+from tracker import bbox_iou, greedy_match
+
+try:
+    from mmdet.apis import inference_detector, init_detector
+except (ImportError, ModuleNotFoundError):
+    raise ImportError(
+        "Failed to import `inference_detector` and "
+        "`init_detector` form `mmdet.apis`. These apis are "
+        "required in this tool! "
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="INT8 quantization of demo models")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["stdet", "det"],
+        choices=("stdet", "det"),
+        help="models to quantize",
+    )
+    parser.add_argument(
+        "--mode",
+        default="static",
+        choices=QUANT_MODES,
+        help="dynamic only quantizes Linear layers, static needs calibration",
+    )
+    parser.add_argument(
+        "--config",
+        default=("stdet_model/my_slowfast_kinetics_pretrained_r50_4x16x1_200e_ava.py"),
+        help="stdet config file, or folder whose first config is shared by "
+        "ensemble members",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=("stdet_model/my_stdet.pth"),
+        help="stdet checkpoint, or folder of ensemble member checkpoints",
+    )
+    parser.add_argument(
+        "--stdet-out",
+        default=None,
+        help="output checkpoint or folder, defaults to the input with _int8",
+    )
+    parser.add_argument(
+        "--det-config",
+        default="stdet_model/my_faster_rcnn_r50_fpn_2x_coco.py",
+        help="human detection config file path (from mmdet)",
+    )
+    parser.add_argument(
+        "--det-checkpoint",
+        default=("stdet_model/my_mmdet.pth"),
+        help="human detection checkpoint file/url",
+    )
+    parser.add_argument(
+        "--det-out",
+        default=None,
+        help="output checkpoint, defaults to the input with _int8",
+    )
+    parser.add_argument(
+        "--records",
+        required=True,
+        help="folder of clips recorded with --record-clips",
+    )
+    parser.add_argument(
+        "--calib-clips",
+        default=16,
+        type=int,
+        help="number of recorded clips used for calibration, the others are "
+        "used for the report",
+    )
+    parser.add_argument(
+        "--max-clips", default=0, type=int, help="max number of recorded clips"
+    )
+    parser.add_argument(
+        "--action-score-thr",
+        type=float,
+        default=0.9,
+        help="the threshold of human action score",
+    )
+    parser.add_argument(
+        "--det-score-thr",
+        type=float,
+        default=0.8,
+        help="the threshold of human detection score",
+    )
+    parser.add_argument(
+        "--repeat", default=10, type=int, help="number of runs to time"
+    )
+    parser.add_argument(
+        "--num-threads",
+        default=0,
+        type=int,
+        help="CPU threads, <= 0 keeps the default",
+    )
+    parser.add_argument("--report", default=None, help="output json report")
+    parser.add_argument(
+        "--cfg-options",
+        nargs="+",
+        action=DictAction,
+        default={},
+        help="override some settings in the used stdet config, the key-value "
+        "pair in xxx=yyy format will be merged into config file",
+    )
+    return parser.parse_args()
+
+
+def int8_path(path):
+    if os.path.isdir(path):
+        return path.rstrip("/") + "_int8"
+    root, ext = os.path.splitext(path)
+    return root + "_int8" + ext
+
+
+def clip_scores(model, samples):
+    """Return [num_bboxes, num_classes] scores of all samples."""
+    scores = []
+    with torch.no_grad():
+        for inputs in samples:
+            result = model(**inputs)[0]
+            num_bboxes = len(inputs["proposals"][0][0])
+            scores.append(np.stack([res[:num_bboxes, 4] for res in result], axis=1))
+    return np.concatenate(scores)
+
+
+def quantize_stdet(args, config, checkpoint, out, calib, evaluation):
+    float_model = build_detector(config.model, test_cfg=config.get("test_cfg"))
+    load_checkpoint(float_model, checkpoint, map_location="cpu")
+    float_model.eval()
+    model = copy.deepcopy(float_model)
+
+    def calibrate(model):
+        for inputs in calib:
+            model(**inputs)
+
+    quantize_model(model, args.mode, calibrate=calibrate)
+    save_quantized(model, out, args.mode, checkpoint=checkpoint)
+    print(f"Saved int8 stdet model to {out}")
+
+    float_scores = clip_scores(float_model, evaluation)
+    int8_scores = clip_scores(model, evaluation)
+    diff = np.abs(int8_scores - float_scores)
+    thr = args.action_score_thr
+    inputs = evaluation[0]
+    with torch.no_grad():
+        float_ms = timeit(lambda: float_model(**inputs), args.repeat)
+        int8_ms = timeit(lambda: model(**inputs), args.repeat)
+    return dict(
+        out=out,
+        num_bboxes=len(float_scores),
+        score_mae=float(diff.mean()),
+        max_score_diff=float(diff.max()),
+        label_agreement=float(((int8_scores >= thr) == (float_scores >= thr)).mean()),
+        float_ms=float_ms,
+        int8_ms=int8_ms,
+    )
+
+
+def quantize_det(args, calib, evaluation):
+    float_model = init_detector(args.det_config, args.det_checkpoint, device="cpu")
+    model = copy.deepcopy(float_model)
+
+    def calibrate(model):
+        for frame in calib:
+            inference_detector(model, frame)
+
+    quantize_model(model, args.mode, calibrate=calibrate)
+    out = args.det_out or int8_path(args.det_checkpoint)
+    save_quantized(model, out, args.mode, checkpoint=args.det_checkpoint)
+    print(f"Saved int8 human detector to {out}")
+
+    def detect(model, frame):
+        bboxes = inference_detector(model, frame)[0]
+        return bboxes[bboxes[:, 4] >= args.det_score_thr]
+
+    num_float, num_int8, num_matched, score_diff = 0, 0, 0, 0.0
+    for frame in evaluation:
+        float_dets, int8_dets = detect(float_model, frame), detect(model, frame)
+        matches = greedy_match(bbox_iou(float_dets[:, :4], int8_dets[:, :4]), 0.5)
+        num_float += len(float_dets)
+        num_int8 += len(int8_dets)
+        num_matched += len(matches)
+        for i, j in matches:
+            score_diff = max(score_diff, abs(float_dets[i, 4] - int8_dets[j, 4]))
+    frame = evaluation[0]
+    return dict(
+        out=out,
+        float_bboxes=num_float,
+        int8_bboxes=num_int8,
+        matched_bboxes=num_matched,
+        recall=num_matched / max(num_float, 1),
+        max_score_diff=float(score_diff),
+        float_ms=timeit(lambda: detect(float_model, frame), args.repeat),
+        int8_ms=timeit(lambda: detect(model, frame), args.repeat),
+    )
+
+
+def main(args):
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    if os.path.isdir(args.config):
+        args.config = os.path.join(args.config, sorted(os.listdir(args.config))[0])
+    config = Config.fromfile(args.config)
+    config.merge_from_dict(args.cfg_options)
+    try:
+        # different actions should have the same number of bboxes
+        config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
+    except KeyError:
+        pass
+    config.model.backbone.pretrained = None
+
+    samples = []
+    for _, inputs in load_records(args.records, "cpu", args.max_clips):
+        # recorded float16 clips are calibrated in float32, like on CPU
+        inputs["img"] = [inputs["img"][0].float()]
+        inputs["proposals"] = [[inputs["proposals"][0][0].float()]]
+        samples.append(inputs)
+    assert samples, f"No recorded clips in {args.records}"
+    calib = samples[: args.calib_clips]
+    evaluation = samples[args.calib_clips :] or calib
+    report = dict(
+        mode=args.mode,
+        engine=torch.backends.quantized.engine,
+        calib_clips=len(calib),
+        eval_clips=len(evaluation),
+        held_out=len(samples) > len(calib),
+    )
+
+    if "stdet" in args.models:
+        out = args.stdet_out or int8_path(args.checkpoint)
+        if os.path.isdir(args.checkpoint):
+            os.makedirs(out, exist_ok=True)
+            report["stdet"] = {
+                file: quantize_stdet(
+                    args,
+                    config,
+                    os.path.join(args.checkpoint, file),
+                    os.path.join(out, file),
+                    calib,
+                    evaluation,
+                )
+                for file in sorted(os.listdir(args.checkpoint))
+                if file.endswith(".pth")
+            }
+        else:
+            report["stdet"] = quantize_stdet(
+                args, config, args.checkpoint, out, calib, evaluation
+            )
+    if "det" in args.models:
+        keyframes = [
+            keyframe for _, keyframe in load_keyframes(args.records, args.max_clips)
+        ]
+        assert keyframes, (
+            f"No display keyframes in {args.records}, record the clips again "
+            "to quantize the detector"
+        )
+        report["det"] = quantize_det(
+            args,
+            keyframes[: args.calib_clips],
+            keyframes[args.calib_clips :] or keyframes[: args.calib_clips],
+        )
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(parse_args())
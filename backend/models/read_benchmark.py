@@ -0,0 +1,118 @@
+"""Micro-benchmark of the read thread preprocessing.
+
+Compares the frames per second of the old read path (two full resolution
+resizes plus float32 normalization for every frame) with the current one
+(a single resize pass into preallocated buffers, only for the frames some
+consumer needs, and `grab()` without decoding for the others). Decoding is
+included in both, pacing is not.
+
+Example:
+    python read_benchmark.py --input-video pool.mp4 --display-height 720
+"""
+import argparse
+import time
+
+import cv2
+import mmcv
+import numpy as np
+
+from stream_utils import FramePlanner
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Read thread micro-benchmark")
+    parser.add_argument("--input-video", required=True, help="input video file")
+    parser.add_argument(
+        "--num-frames", default=300, type=int, help="number of frames to read"
+    )
+    parser.add_argument("--display-height", default=0, type=int)
+    parser.add_argument("--stdet-input-shortside", default=256, type=int)
+    parser.add_argument("--clip-len", default=8, type=int)
+    parser.add_argument("--frame-interval", default=8, type=int)
+    parser.add_argument("--predict-stepsize", default=8, type=int)
+    parser.add_argument("--output-fps", default=15, type=int)
+    return parser.parse_args()
+
+
+def run(args, read_one, planner=None):
+    cap = cv2.VideoCapture(args.input_video)
+    assert cap.isOpened()
+    start = time.time()
+    cnt = 0
+    while cnt < args.num_frames:
+        if planner is None or planner.needs_display(cnt) or planner.needs_stdet(cnt):
+            was_read, frame = cap.read()
+        else:
+            was_read, frame = cap.grab(), None
+        if not was_read:
+            break
+        read_one(cnt, frame)
+        cnt += 1
+    cap.release()
+    return cnt / (time.time() - start)
+
+
+def main(args):
+    cap = cv2.VideoCapture(args.input_video)
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    stdet_size = mmcv.rescale_size((w, h), (args.stdet_input_shortside, np.Inf))
+    if args.display_height > 0:
+        display_size = mmcv.rescale_size((w, h), (np.Inf, args.display_height))
+    else:
+        display_size = (w, h)
+    mean = np.array([123.675, 116.28, 103.53])
+    std = np.array([58.395, 57.12, 57.375])
+
+    def read_old(seq, frame):
+        mmcv.imresize(frame, display_size)
+        processed = mmcv.imresize(frame, stdet_size).astype(np.float32)
+        mmcv.imnormalize_(processed, mean, std, to_rgb=False)
+
+    window_size = args.clip_len * args.frame_interval
+    frame_start = window_size // 2 - (args.clip_len // 2) * args.frame_interval
+    display_start = window_size // 2 - args.predict_stepsize // 2
+    stride = 1
+    if source_fps > args.output_fps:
+        stride = round(source_fps / args.output_fps)
+    planner = FramePlanner(
+        args.predict_stepsize,
+        stdet_inds=[
+            frame_start + args.frame_interval * i for i in range(args.clip_len)
+        ],
+        clip_display_inds=[window_size // 2, display_start],
+        display_stride=stride,
+    )
+    display_out = np.empty((display_size[1], display_size[0], 3), np.uint8)
+    stdet_out = np.empty((stdet_size[1], stdet_size[0], 3), np.uint8)
+    display_larger = np.prod(display_size) >= np.prod(stdet_size)
+
+    def read_new(seq, frame):
+        need_display = planner.needs_display(seq)
+        need_stdet = planner.needs_stdet(seq)
+        if need_display and need_stdet:
+            if display_larger:
+                mmcv.imresize(frame, display_size, out=display_out)
+                mmcv.imresize(display_out, stdet_size, out=stdet_out)
+            else:
+                mmcv.imresize(frame, stdet_size, out=stdet_out)
+                mmcv.imresize(stdet_out, display_size, out=display_out)
+        elif need_display:
+            mmcv.imresize(frame, display_size, out=display_out)
+        elif need_stdet:
+            mmcv.imresize(frame, stdet_size, out=stdet_out)
+
+    decode_fps = run(args, lambda seq, frame: None)
+    old_fps = run(args, read_old)
+    new_fps = run(args, read_new, planner)
+    print(f"source {w}x{h} @ {source_fps:.1f} fps, display {display_size}")
+    print(f"decode only:     {decode_fps:.1f} fps")
+    print(f"old read thread: {old_fps:.1f} fps")
+    print(f"new read thread: {new_fps:.1f} fps")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,291 @@
+"""Local inference server of the spatio-temporal action detection model.
+
+The stdet model is loaded once in this process and shared by every camera
+process connected to it, so stream processes stay small and can restart
+without reloading the checkpoint. Requests of all clients are merged into
+batched forward passes of the backbone, limited by `--max-batch-size` and
+`--max-delay`, and CPU threads are tuned in one place with
+`--num-threads`.
+
+Clients connect over a Unix socket, or a named pipe such as
+`\\\\.\\pipe\\stdet` on Windows, and send the normalized clip and the
+proposals of `TaskInfo.get_model_inputs`. Requests are pickled, so both
+sides share a secret key, taken from the `STDET_SERVER_AUTHKEY` environment
+variable by default, and connections that fail to prove they know it are
+closed before anything is unpickled.
+
+Example:
+    export STDET_SERVER_AUTHKEY=$(openssl rand -hex 32)
+    python stdet_server.py --address /tmp/stdet.sock --max-batch-size 4
+    python my_webcam_demo_spatiotemporal_det.py --stdet-server /tmp/stdet.sock
+"""
+import argparse
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import torch
+from mmcv import Config, DictAction
+from mmcv.runner import load_checkpoint
+
+from mmaction.models import build_detector
+
+logger = logging.getLogger(__name__)
+
+AUTHKEY_ENV = "STDET_SERVER_AUTHKEY"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MMAction2 stdet inference server")
+    parser.add_argument(
+        "--config",
+        default=("stdet_model/my_slowfast_kinetics_pretrained_r50_4x16x1_200e_ava.py"),
+        help="spatio temporal detection config file path",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=("stdet_model/my_stdet.pth"),
+        help="spatio temporal detection checkpoint file/url",
+    )
+    parser.add_argument(
+        "--address",
+        default="/tmp/stdet_server.sock",
+        help="unix socket path or windows named pipe to listen on",
+    )
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get(AUTHKEY_ENV),
+        help=f"secret key clients must know, defaults to ${AUTHKEY_ENV}, "
+        "which unlike this option is not visible to other users",
+    )
+    parser.add_argument(
+        "--device", type=str, default="cuda:0", help="CPU/CUDA device option"
+    )
+    parser.add_argument(
+        "--fp16",
+        action="store_true",
+        help="run the model in half precision, clients must send float16 "
+        "inputs (`--input-dtype float16`)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        default=4,
+        type=int,
+        help="max number of clips in one forward pass",
+    )
+    parser.add_argument(
+        "--max-delay",
+        default=0.01,
+        type=float,
+        help="max seconds a request waits for others to fill a batch",
+    )
+    parser.add_argument(
+        "--num-threads",
+        default=0,
+        type=int,
+        help="number of torch intra-op CPU threads, <= 0 keeps the default",
+    )
+    parser.add_argument(
+        "--cfg-options",
+        nargs="+",
+        action=DictAction,
+        default={},
+        help="override some settings in the used config, the key-value pair "
+        "in xxx=yyy format will be merged into config file",
+    )
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f"an authkey is required, set ${AUTHKEY_ENV} or --authkey")
+    return args
+
+
+class StdetServer:
+    """Serve batched stdet inference to several clients.
+
+    Every connection gets a receiving thread which queues its requests. A
+    single batching thread collects up to `max_batch_size` requests, waiting
+    at most `max_delay` seconds after the first one, runs the backbone once
+    on the stacked clips and the RoI head on each clip with its own
+    proposals. Clips of different shapes, e.g. from cameras with different
+    aspect ratios, are forwarded in separate batches.
+
+    A request is a tuple `(img, proposals, img_shape)` where `img` is the
+    (1, c, t, h, w) clip and `proposals` the (n, 4) bboxes, both ndarrays.
+    The reply is the stdet result of the clip, a list of (n, 5) ndarrays per
+    class, or the exception raised while computing it.
+
+    Args:
+        model (nn.Module): Stdet model in eval mode.
+        device (str): CPU/CUDA device of the model.
+        max_batch_size (int): Max number of clips in one forward pass.
+            Default: 4.
+        max_delay (float): Max seconds to wait for more requests to fill a
+            batch. Default: 0.01.
+    """
+
+    def __init__(self, model, device, max_batch_size=4, max_delay=0.01):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+
+    def serve_forever(self, address, authkey):
+        """Accept clients on `address` until interrupted.
+
+        Args:
+            address (str): Unix socket path or windows named pipe.
+            authkey (str | bytes): Secret key clients must know.
+        """
+        if isinstance(authkey, str):
+            authkey = authkey.encode()
+        threading.Thread(
+            target=self._batch_loop, name="Batch-Thread", daemon=True
+        ).start()
+        with Listener(address, authkey=authkey) as listener:
+            logger.info(f"Stdet server listening on {address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    logger.warning(f"Stdet server rejected a client: {e!r}")
+                    continue
+                threading.Thread(
+                    target=self._recv_loop, args=(conn,), daemon=True
+                ).start()
+
+    def _recv_loop(self, conn):
+        try:
+            while True:
+                self.requests.put((conn, conn.recv()))
+        except (EOFError, OSError):
+            # client disconnected, e.g. a restarting stream process
+            conn.close()
+
+    def _get_batch(self):
+        items = [self.requests.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(items) < self.max_batch_size:
+            try:
+                items.append(
+                    self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except queue.Empty:
+                break
+        return items
+
+    def _batch_loop(self):
+        while True:
+            groups = collections.defaultdict(list)
+            for conn, request in self._get_batch():
+                groups[request[0].shape].append((conn, request))
+
+            for group in groups.values():
+                start_time = time.time()
+                try:
+                    results = self.forward([request for _, request in group])
+                except Exception as e:
+                    logger.exception("Stdet server forward failed")
+                    results = [e] * len(group)
+                for (conn, _), result in zip(group, results):
+                    try:
+                        conn.send(result)
+                    except (EOFError, OSError):
+                        pass  # client went away while waiting
+                logger.debug(
+                    f"Stdet server batch: {len(group)} clips, "
+                    f"{1000*(time.time() - start_time):.0f} ms, "
+                    f"{self.requests.qsize()} waiting"
+                )
+
+    def forward(self, requests):
+        """Run the stdet model on a list of requests of the same shape.
+
+        Returns:
+            list: Stdet result of each request.
+        """
+        imgs = np.concatenate([img for img, _, _ in requests])
+        imgs = torch.from_numpy(imgs).to(self.device)
+        results = []
+        with torch.no_grad():
+            feats = self.model.extract_feat(imgs)
+            for idx, (_, proposals, img_shape) in enumerate(requests):
+                if isinstance(feats, tuple):
+                    x = tuple(feat[idx : idx + 1] for feat in feats)
+                else:
+                    x = feats[idx : idx + 1]
+                proposals = torch.from_numpy(proposals).to(self.device)
+                # the RoI head only accepts one clip in test mode
+                result = self.model.roi_head.simple_test(
+                    x, [proposals], [dict(img_shape=img_shape)], rescale=False
+                )
+                results.append(result[0])
+        return results
+
+
+class StdetClient:
+    """Client of a `StdetServer`.
+
+    Each calling thread opens its own connection, so parallel stdet workers
+    can have several requests in flight and replies never get mixed up.
+
+    Args:
+        address (str): Address the server listens on.
+        authkey (str | bytes): Secret key of the server.
+    """
+
+    def __init__(self, address, authkey):
+        if isinstance(authkey, str):
+            authkey = authkey.encode()
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def __call__(self, img, proposals, img_shape):
+        """Send one clip to the server and wait for its stdet result."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = Client(self.address, authkey=self.authkey)
+        conn.send((img, proposals, img_shape))
+        result = conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def main(args):
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    config = Config.fromfile(args.config)
+    config.merge_from_dict(args.cfg_options)
+    try:
+        # different actions should have the same number of bboxes
+        config["model"]["test_cfg"]["rcnn"]["action_thr"] = 0.0
+    except KeyError:
+        pass
+
+    config.model.backbone.pretrained = None
+    model = build_detector(config.model, test_cfg=config.get("test_cfg"))
+    load_checkpoint(model, args.checkpoint, map_location="cpu")
+    model.to(args.device)
+    if args.fp16:
+        model.half()
+    model.eval()
+
+    if os.name == "posix" and os.path.exists(args.address):
+        # stale socket of a previous server
+        os.remove(args.address)
+    server = StdetServer(model, args.device, args.max_batch_size, args.max_delay)
+    server.serve_forever(args.address, args.authkey)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    main(parse_args())
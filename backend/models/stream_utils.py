@@ -0,0 +1,557 @@
+"""Helpers for the read, main and display threads of a live video pipeline."""
+import collections
+import logging
+import queue
+import threading
+import re
+import time
+
+try:
+    import pafy
+except (ImportError, ModuleNotFoundError):
+    pafy = None
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLICIES = ("block", "drop-oldest", "keep-latest")
+YOUTUBE_URL = re.compile(r"^https?://(www\.|m\.)?(youtube\.com|youtu\.be)/")
+
+# A stage of `StagePipeline`. Batched stages (`batch_size` is not None)
+# collect up to `batch_size` items, waiting at most `batch_timeout` seconds
+# after the first one, and call `fn` with the list of items.
+Stage = collections.namedtuple(
+    "Stage",
+    ["name", "fn", "num_workers", "batch_size", "batch_timeout"],
+    defaults=(1, None, 0.0),
+)
+
+
+class BoundedTaskQueue:
+    """Bounded FIFO queue with a configurable overload policy.
+
+    The interface follows `queue.Queue` (`put`, `get`, `qsize`) so it can be
+    used as a drop-in replacement.
+
+    Policies:
+
+    1) block: `put` waits until there is free space.
+    2) drop-oldest: when full, `put` drops the oldest queued item.
+    3) keep-latest: `put` drops every queued item, so consumers always get
+        the freshest one.
+
+    Args:
+        maxsize (int): Max number of queued items. Values <= 0 mean
+            unbounded. Default: 0.
+        policy (str): One of `QUEUE_POLICIES`. Default: 'block'.
+        on_drop (callable, optional): Called with each dropped item, outside
+            of the queue lock. Default: None.
+    """
+
+    def __init__(self, maxsize=0, policy="block", on_drop=None):
+        assert policy in QUEUE_POLICIES, f"unknown queue policy {policy}"
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+        # statistics
+        self.put_count = 0
+        self.dropped = 0
+
+    def _full(self):
+        return 0 < self.maxsize <= len(self.items)
+
+    def put(self, item, droppable=True):
+        """Put an item into the queue.
+
+        Args:
+            item: The item to put.
+            droppable (bool): Whether a `drop-*` policy may drop this item
+                later on. Items which must not be lost, e.g. the end of
+                stream marker, always block while the queue is full.
+                Default: True.
+
+        Returns:
+            bool: False if the queue was closed before the item was put.
+        """
+        dropped = []
+        with self.cond:
+            if self.policy == "keep-latest":
+                dropped = self._pop_droppable(len(self.items))
+            elif self.policy == "drop-oldest" and self._full():
+                dropped = self._pop_droppable(len(self.items) - self.maxsize + 1)
+            while self._full() and not self.closed:
+                self.cond.wait(timeout=0.1)
+            if self.closed:
+                return False
+            self.items.append((item, droppable))
+            self.put_count += 1
+            self.dropped += len(dropped)
+            self.cond.notify_all()
+
+        if self.on_drop is not None:
+            for dropped_item in dropped:
+                self.on_drop(dropped_item)
+        return True
+
+    def _pop_droppable(self, num):
+        """Remove up to `num` of the oldest droppable items."""
+        dropped = []
+        kept = collections.deque()
+        while self.items and len(dropped) < num:
+            item, droppable = self.items.popleft()
+            if droppable:
+                dropped.append(item)
+            else:
+                kept.append((item, droppable))
+        self.items.extendleft(reversed(kept))
+        return dropped
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item.
+
+        Raises:
+            queue.Empty: If no item is available within `timeout` seconds.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout=timeout):
+                raise queue.Empty
+            item, _ = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def qsize(self):
+        with self.cond:
+            return len(self.items)
+
+    def close(self):
+        """Wake up and stop any producer blocked in `put`."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class PacingClock:
+    """Pace frame reads to the timestamps of the source video.
+
+    The first frame anchors the source timeline to the wall clock. Every
+    later frame is released when its timestamp is due, so time spent on
+    decoding and preprocessing is not added on top of the frame interval
+    and the reader does not drift behind the source.
+
+    A frame due more than `max_wait_frames` frame intervals ahead is a jump
+    of the source timeline, e.g. after an RTSP discontinuity, a camera
+    reconnect or broken timestamps. It re-anchors the timeline instead of
+    stalling the reader for the whole gap.
+
+    Args:
+        fps (float): Frame rate used when the source doesn't report
+            increasing timestamps, e.g. some network streams.
+        max_speed (bool): Never wait, read as fast as possible. Useful for
+            offline files. Default: False.
+        max_wait_frames (float): Max wait for a frame, in frame intervals.
+            Default: 4.
+    """
+
+    def __init__(self, fps, max_speed=False, max_wait_frames=4):
+        self.frame_interval = 1000 / fps
+        self.max_speed = max_speed
+        self.max_wait = max_wait_frames * self.frame_interval / 1000
+        self.start_time = None  # wall clock time of the first frame
+        self.start_pts = None  # timestamp of the first frame, in ms
+        self.last_pts = None
+
+        # lateness statistics since the last `pop_stats()`, in ms
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+        self.frame_cnt = 0
+        self.discontinuities = 0
+
+    def wait(self, pts):
+        """Wait until the frame with timestamp `pts` is due.
+
+        Args:
+            pts (float): Frame timestamp in ms, e.g. `CAP_PROP_POS_MSEC`.
+
+        Returns:
+            float: How late the frame was in ms, 0 if it was on time.
+        """
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time, self.start_pts, self.last_pts = now, pts, pts
+            return 0.0
+
+        if pts <= self.last_pts:
+            pts = self.last_pts + self.frame_interval
+        self.last_pts = pts
+
+        due_time = self.start_time + (pts - self.start_pts) / 1000
+        if due_time - now > self.max_wait:
+            # the timeline jumped ahead, this frame is due now
+            self.start_time, self.start_pts = now, pts
+            self.discontinuities += 1
+            lateness = 0.0
+        elif now < due_time:
+            if not self.max_speed:
+                time.sleep(due_time - now)
+            lateness = 0.0
+        else:
+            lateness = 1000 * (now - due_time)
+
+        self.lateness_sum += lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+        self.frame_cnt += 1
+        return lateness
+
+    def pop_stats(self):
+        """Return the statistics since the last call and reset them.
+
+        Returns:
+            tuple: Mean and max lateness in ms, and the number of timeline
+                jumps.
+        """
+        mean = self.lateness_sum / max(self.frame_cnt, 1)
+        stats = (mean, self.lateness_max, self.discontinuities)
+        self.lateness_sum, self.lateness_max, self.frame_cnt = 0.0, 0.0, 0
+        self.discontinuities = 0
+        return stats
+
+
+class FramePlanner:
+    """Decide which consumers need each frame of a stream.
+
+    Clips start every `predict_stepsize` frames, so whether a frame is used
+    by a consumer only depends on its offsets inside the clips covering it.
+    Frames are addressed by their sequence number in the stream.
+
+    Args:
+        predict_stepsize (int): Number of frames between two clips.
+        stdet_inds (list[int]): Offsets in a clip sampled by the stdet
+            model.
+        clip_display_inds (list[int]): Offsets in a clip whose display frame
+            is read besides showing it, e.g. the human detector keyframe.
+        display_stride (int): Show one of every `display_stride` frames.
+            Default: 1.
+    """
+
+    def __init__(
+        self, predict_stepsize, stdet_inds, clip_display_inds, display_stride=1
+    ):
+        self.predict_stepsize = predict_stepsize
+        self.display_stride = display_stride
+        self.stdet_residues = self._residues(stdet_inds)
+        self.display_residues = self._residues(clip_display_inds)
+
+    def _residues(self, inds):
+        """Map `offset % predict_stepsize` to the first frame using it."""
+        residues = {}
+        for idx in inds:
+            residue = idx % self.predict_stepsize
+            residues[residue] = min(idx, residues.get(residue, idx))
+        return residues
+
+    def _in_clips(self, seq, residues):
+        first = residues.get(seq % self.predict_stepsize)
+        return first is not None and seq >= first
+
+    def is_shown(self, seq):
+        """Whether the frame is shown/written by the display thread."""
+        return seq % self.display_stride == 0
+
+    def needs_display(self, seq):
+        """Whether the display-size frame is read by anyone."""
+        return self.is_shown(seq) or self._in_clips(seq, self.display_residues)
+
+    def needs_stdet(self, seq):
+        """Whether the frame is sampled by the stdet model."""
+        return self._in_clips(seq, self.stdet_residues)
+
+
+class StagePipeline:
+    """Run consecutive processing stages concurrently.
+
+    Every stage has its own worker threads and a bounded queue in front of
+    it, so while a stage works on item n the previous stage can already
+    work on item n + 1. Items leave a stage with one worker in the order
+    they came in. Stages with several workers process items in parallel and
+    may reorder them, use a `ReorderBuffer` downstream if order matters.
+
+    If a stage raises, the error is logged and `failed` is set. The items of
+    the failed call and every later item, including those given to `put()`,
+    are passed to `on_discard` without processing, and the error is raised
+    again by `join()`.
+
+    Args:
+        stages (list[tuple]): `Stage` or `Stage`-like tuple of each stage.
+            A function gets the output of the previous stage, the output of
+            the last stage is dropped. Functions of batched stages get and
+            return lists of items.
+        queue_size (int): Capacity of the queue in front of each stage,
+            at least the batch size for batched stages. Default: 2.
+        on_discard (callable, optional): Called with each item thrown away
+            after a failure, e.g. to free its resources. Default: None.
+    """
+
+    _stop = object()
+
+    def __init__(self, stages, queue_size=2, on_discard=None):
+        self.stages = [Stage(*stage) for stage in stages]
+        self.queues = [
+            queue.Queue(maxsize=max(queue_size, stage.batch_size or 0))
+            for stage in self.stages
+        ]
+        self.threads = [
+            threading.Thread(
+                target=self._work,
+                args=(idx,),
+                name=f"{stage.name}-Stage-{worker_id}",
+                daemon=True,
+            )
+            for idx, stage in enumerate(self.stages)
+            for worker_id in range(stage.num_workers)
+        ]
+        # number of running workers per stage, the last one to stop tells
+        # the workers of the next stage to stop
+        self.running = [stage.num_workers for stage in self.stages]
+        self.running_lock = threading.Lock()
+        # max number of items inside the pipeline, queued or being processed
+        self.capacity = sum(
+            in_queue.maxsize + stage.num_workers * (stage.batch_size or 1)
+            for stage, in_queue in zip(self.stages, self.queues)
+        )
+        self.on_discard = on_discard
+        self.failed = threading.Event()
+        self.error = None
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _stop_stage(self, idx):
+        with self.running_lock:
+            self.running[idx] -= 1
+            last = self.running[idx] == 0
+        if last and idx + 1 < len(self.stages):
+            for _ in range(self.stages[idx + 1].num_workers):
+                self.queues[idx + 1].put(self._stop)
+
+    def _get_batch(self, in_queue, stage):
+        """Get the next items of a stage, stops after the stop marker."""
+        items = [in_queue.get()]
+        if stage.batch_size is None:
+            return items
+        deadline = time.monotonic() + stage.batch_timeout
+        while len(items) < stage.batch_size and items[-1] is not self._stop:
+            try:
+                items.append(in_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return items
+
+    def _work(self, idx):
+        stage = self.stages[idx]
+        in_queue = self.queues[idx]
+        out_queue = self.queues[idx + 1] if idx + 1 < len(self.queues) else None
+        while True:
+            items = self._get_batch(in_queue, stage)
+            stop = items[-1] is self._stop
+            if stop:
+                items.pop()
+            if items and self.failed.is_set():
+                self._discard(items)
+            elif items:
+                start_time = time.time()
+                try:
+                    if stage.batch_size is None:
+                        items = [stage.fn(items[0])]
+                    else:
+                        items = stage.fn(items)
+                except Exception as e:
+                    logger.exception(f"{stage.name} stage failed")
+                    self.error = e
+                    self.failed.set()
+                    self._discard(items)
+                    items = []
+                cost = 1000 * (time.time() - start_time)
+                logger.debug(
+                    f"{stage.name} stage: {cost:.0f} ms, {len(items)} items, "
+                    f"{cost / max(len(items), 1):.0f} ms per item"
+                )
+                if out_queue is not None:
+                    for item in items:
+                        out_queue.put(item)
+            if stop:
+                self._stop_stage(idx)
+                return
+
+    def _discard(self, items):
+        if self.on_discard is None:
+            return
+        for item in items:
+            try:
+                self.on_discard(item)
+            except Exception:
+                logger.exception("Failed to discard an item")
+
+    def put(self, item):
+        """Feed an item to the first stage, blocks while it is busy.
+
+        Returns:
+            bool: False if a stage failed and the item was discarded.
+        """
+        if self.failed.is_set():
+            self._discard([item])
+            return False
+        self.queues[0].put(item)
+        return True
+
+    def join(self):
+        """Wait until all fed items went through every stage."""
+        for _ in range(self.stages[0].num_workers):
+            self.queues[0].put(self._stop)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class ReorderBuffer:
+    """Release items in index order although they are put out of order.
+
+    Items are put with consecutive indexes, e.g. `task.id`, and `get()`
+    returns them strictly in that order. If the next index is missing for
+    `skip_timeout` seconds while later timed items are already waiting, the
+    straggler is skipped. Items which arrive after being skipped are passed
+    to `on_late` instead.
+
+    Only timed items start the skip timer. Items that bypass the slow work,
+    like an end of stream marker or clips dropped before inference, are put
+    untimed, so their early arrival does not make every clip still in
+    flight look late.
+
+    Args:
+        start (int): Index of the first item. Default: 0.
+        window (int): Max distance between the next index to release and
+            the index of a new item, `put()` blocks beyond it. Values <= 0
+            mean unbounded. Default: 0.
+        skip_timeout (float, optional): Seconds to wait for a missing index
+            before skipping it. None means never skip. Default: None.
+        on_late (callable, optional): Called with each late item, outside
+            of the buffer lock. Default: None.
+    """
+
+    def __init__(self, start=0, window=0, skip_timeout=None, on_late=None):
+        self.next_id = start
+        self.window = window
+        self.skip_timeout = skip_timeout
+        self.on_late = on_late
+        self.items = {}
+        self.timed = set()  # indexes of waiting timed items
+        self.cond = threading.Condition()
+        self.closed = False
+        self.wait_start = None  # when we started to wait for a straggler
+
+        # statistics
+        self.released = 0
+        self.skipped = 0
+        self.late = 0
+        self.max_pending = 0
+
+    def put(self, idx, item, timed=True):
+        """Add the item with index `idx`.
+
+        Args:
+            idx (int): Index of the item.
+            item (object): The item.
+            timed (bool): Whether the item may start the skip timer of the
+                missing items before it. Default: True.
+
+        Returns:
+            bool: False if the item was late or the buffer was closed.
+        """
+        with self.cond:
+            while 0 < self.window <= idx - self.next_id and not self.closed:
+                self.cond.wait(timeout=0.1)
+            late = idx < self.next_id
+            if late:
+                self.late += 1
+            elif not self.closed:
+                self.items[idx] = item
+                if timed:
+                    self.timed.add(idx)
+                self.max_pending = max(self.max_pending, len(self.items))
+                self.cond.notify_all()
+                return True
+
+        if late and self.on_late is not None:
+            self.on_late(item)
+        return False
+
+    def get(self, timeout=None):
+        """Return the next `(idx, item)` in order.
+
+        Returns:
+            tuple | None: None if nothing could be released within `timeout`
+                seconds or the buffer was closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self.closed:
+                if self.next_id in self.items:
+                    idx = self.next_id
+                    item = self.items.pop(idx)
+                    self.timed.discard(idx)
+                    self.next_id += 1
+                    self.released += 1
+                    self.wait_start = None
+                    self.cond.notify_all()
+                    return idx, item
+
+                now = time.monotonic()
+                wait_time = None if deadline is None else deadline - now
+                if self.timed and self.skip_timeout is not None:
+                    if self.wait_start is None:
+                        self.wait_start = now
+                    skip_time = self.wait_start + self.skip_timeout - now
+                    if skip_time <= 0:
+                        first = min(self.items)
+                        logger.warning(f"Skip stragglers {self.next_id}~{first - 1}")
+                        self.skipped += first - self.next_id
+                        self.next_id = first
+                        self.cond.notify_all()
+                        continue
+                    if wait_time is None or skip_time < wait_time:
+                        wait_time = skip_time
+                if wait_time is not None and wait_time <= 0:
+                    return None
+                self.cond.wait(wait_time)
+            return None
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+    def close(self):
+        """Wake up and stop every waiting thread."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+def resolve_input_video(input_video):
+    """Return what `cv2.VideoCapture` can open for an input video.
+
+    YouTube page URLs are resolved to their best mp4 stream with pafy, which
+    queries YouTube, so it only happens for such inputs and when a stream is
+    opened, never at import time. Other inputs are returned unchanged.
+    """
+    if not isinstance(input_video, str) or not YOUTUBE_URL.match(input_video):
+        return input_video
+    if pafy is None:
+        raise ImportError(
+            "Failed to import `pafy`, it is required to read YouTube videos"
+        )
+    return pafy.new(input_video).getbest(preftype="mp4").url
@@ -0,0 +1,320 @@
+"""Lightweight IoU/Kalman multi-object tracker for human bboxes."""
+import itertools
+import threading
+
+import numpy as np
+
+
+def bbox_iou(bboxes1, bboxes2):
+    """IoU of every pair of bboxes in (xmin, ymin, xmax, ymax) format.
+
+    Args:
+        bboxes1 (ndarray): Bboxes with shape [n, 4].
+        bboxes2 (ndarray): Bboxes with shape [m, 4].
+
+    Returns:
+        ndarray: IoU matrix with shape [n, m].
+    """
+    lt = np.maximum(bboxes1[:, None, :2], bboxes2[None, :, :2])
+    rb = np.minimum(bboxes1[:, None, 2:], bboxes2[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area1 = np.prod(bboxes1[:, 2:] - bboxes1[:, :2], axis=1)
+    area2 = np.prod(bboxes2[:, 2:] - bboxes2[:, :2], axis=1)
+    return inter / np.maximum(area1[:, None] + area2[None, :] - inter, 1e-6)
+
+
+def greedy_match(iou, iou_thr):
+    """Match rows and columns of an IoU matrix, best pairs first.
+
+    Returns:
+        list[tuple[int]]: Matched (row, col) pairs with IoU >= `iou_thr`.
+    """
+    matches = []
+    if iou.size == 0:
+        return matches
+    rows, cols = np.unravel_index(np.argsort(-iou, axis=None), iou.shape)
+    used_rows, used_cols = set(), set()
+    for row, col in zip(rows, cols):
+        if iou[row, col] < iou_thr:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((row, col))
+    return matches
+
+
+class KalmanBoxTrack:
+    """Constant velocity Kalman filter of one bbox.
+
+    The state is (cx, cy, w, h) and their velocities per time step, noise
+    scales with the bbox height as in DeepSORT.
+
+    Args:
+        bbox (ndarray): First bbox (xmin, ymin, xmax, ymax).
+        score (float): Detection score of the bbox.
+        time (int): Time step of the detection.
+        track_id (int): Id of the track.
+    """
+
+    std_pos = 1 / 20
+    std_vel = 1 / 160
+
+    def __init__(self, bbox, score, time, track_id):
+        self.id = track_id
+        self.mean = np.zeros(8)
+        self.mean[:4] = self._to_xywh(bbox)
+        h = self.mean[3]
+        std = np.array([2 * self.std_pos * h] * 4 + [10 * self.std_vel * h] * 4)
+        self.cov = np.diag(np.square(std))
+        self.score = score
+        self.time = time
+        self.misses = 0
+
+    @staticmethod
+    def _to_xywh(bbox):
+        return np.array(
+            [
+                (bbox[0] + bbox[2]) / 2,
+                (bbox[1] + bbox[3]) / 2,
+                bbox[2] - bbox[0],
+                bbox[3] - bbox[1],
+            ]
+        )
+
+    def bbox(self, time):
+        """Predicted bbox (xmin, ymin, xmax, ymax) at `time`, state unchanged."""
+        cx, cy, w, h = self.mean[:4] + self.mean[4:] * max(time - self.time, 0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self, time):
+        """Advance the state to `time`."""
+        for _ in range(time - self.time):
+            h = self.mean[3]
+            std = np.array([self.std_pos * h] * 4 + [self.std_vel * h] * 4)
+            motion = np.eye(8)
+            motion[:4, 4:] = np.eye(4)
+            self.mean = motion @ self.mean
+            self.cov = motion @ self.cov @ motion.T + np.diag(np.square(std))
+        self.time = max(time, self.time)
+
+    def update(self, bbox, score):
+        """Correct the state with a matched detection."""
+        h = self.mean[3]
+        noise = np.diag(np.square([self.std_pos * h] * 4))
+        proj_cov = self.cov[:4, :4] + noise
+        gain = np.linalg.solve(proj_cov, self.cov[:4]).T
+        self.mean = self.mean + gain @ (self._to_xywh(bbox) - self.mean[:4])
+        self.cov = self.cov - gain @ self.cov[:4]
+        self.score = score
+        self.misses = 0
+
+
+class IouTracker:
+    """Track bboxes of one camera across keyframes.
+
+    Detections are associated with the predicted bboxes of existing tracks
+    by greedy IoU matching. Unmatched detections start new tracks and
+    tracks missed by more than `max_misses` detections are removed. Between
+    detections, bboxes are propagated with each track's Kalman filter and
+    the track confidence, the last detection score, decays by `decay` per
+    time step.
+
+    Time steps are clip indices. `bboxes()` does not change any state, so
+    clips propagated out of order still get consistent bboxes.
+
+    Args:
+        iou_thr (float): Min IoU of a detection and a track to match them.
+            Default: 0.3.
+        max_misses (int): Max number of consecutive detections a track may
+            be missing from before it is removed. Default: 1.
+        decay (float): Confidence decay per propagated time step.
+            Default: 0.9.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, iou_thr=0.3, max_misses=1, decay=0.9):
+        self.iou_thr = iou_thr
+        self.max_misses = max_misses
+        self.decay = decay
+        self.tracks = []
+        self.time = None  # time of the last update
+
+    def _visible_tracks(self):
+        return [track for track in self.tracks if track.misses == 0]
+
+    def bboxes(self, time):
+        """Propagated bboxes with shape [n, 4] of visible tracks at `time`."""
+        bboxes = [track.bbox(time) for track in self._visible_tracks()]
+        return np.array(bboxes, dtype=np.float32).reshape(-1, 4)
+
+    def track_ids(self):
+        """Ids of the visible tracks, in the order of `bboxes()`."""
+        return [track.id for track in self._visible_tracks()]
+
+    def confidence(self, time):
+        """Min confidence of the visible tracks at `time`.
+
+        The confidence decays from the last update on, and is 0 before it.
+        """
+        if self.time is None:
+            return 0.0
+        steps = max(time - self.time, 0)
+        scores = [track.score for track in self._visible_tracks()]
+        return min(scores, default=1.0) * self.decay**steps
+
+    def update(self, time, bboxes, scores=None):
+        """Associate detections at `time` with the tracks.
+
+        Args:
+            time (int): Time step of the detections.
+            bboxes (ndarray): Detected bboxes with shape [n, 4].
+            scores (ndarray, optional): Detection scores. Default: None,
+                meaning 1 for every bbox.
+
+        Returns:
+            tuple: Track id of each detection, None for all of them if the
+                detections are older than the last update, and the mean IoU
+                of the matched detections and the bboxes propagated to
+                `time`, None without matches.
+        """
+        if scores is None:
+            scores = np.ones(len(bboxes))
+        if self.time is not None and time < self.time:
+            # stale detection of a clip finished out of order
+            return None, None
+
+        for track in self.tracks:
+            track.predict(time)
+        predicted = np.array([track.bbox(time) for track in self.tracks])
+        iou = bbox_iou(predicted.reshape(-1, 4), bboxes)
+        matches = greedy_match(iou, self.iou_thr)
+
+        track_ids = [None] * len(bboxes)
+        matched_tracks = set()
+        for track_idx, bbox_idx in matches:
+            self.tracks[track_idx].update(bboxes[bbox_idx], scores[bbox_idx])
+            matched_tracks.add(track_idx)
+            track_ids[bbox_idx] = self.tracks[track_idx].id
+        for track_idx, track in enumerate(self.tracks):
+            if track_idx not in matched_tracks:
+                track.misses += 1
+        self.tracks = [
+            track for track in self.tracks if track.misses <= self.max_misses
+        ]
+        for bbox_idx in range(len(bboxes)):
+            if track_ids[bbox_idx] is None:
+                track_ids[bbox_idx] = next(self._ids)
+                self.tracks.append(
+                    KalmanBoxTrack(
+                        bboxes[bbox_idx], scores[bbox_idx], time, track_ids[bbox_idx]
+                    )
+                )
+        self.time = time
+
+        if not matches:
+            return track_ids, None
+        return track_ids, float(np.mean([iou[row, col] for row, col in matches]))
+
+
+class TrackScoreCache:
+    """Recent stdet results of each track, to skip clips of safe swimmers.
+
+    A track is stable once its `alert_label` score stayed below `safe_thr`
+    for `stable_clips` evaluations in a row. Other actions, swimming above
+    all, do not keep a track from being stable. A clip may reuse the cached
+    results when all of its tracks are stable and were evaluated less than
+    `interval` clips ago. New and borderline tracks therefore force an
+    evaluation every clip. The stdet backbone runs once per clip, so
+    evaluating a clip refreshes the cache of all of its tracks.
+
+    Args:
+        safe_thr (float): Max `alert_label` score of a safe track.
+        stable_clips (int): Number of safe evaluations in a row before a
+            track is stable. Default: 3.
+        interval (int): Max number of clips between two evaluations of a
+            stable track. Default: 4.
+        alert_label (str): Label whose score decides whether a track is
+            safe. Default: 'drowning'.
+    """
+
+    def __init__(self, safe_thr, stable_clips=3, interval=4, alert_label="drowning"):
+        self.safe_thr = safe_thr
+        self.alert_label = alert_label
+        self.stable_clips = stable_clips
+        self.interval = interval
+        # (area_id, track_id) -> [preds, number of safe evaluations, time]
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.num_clips = 0
+        self.num_hits = 0
+
+    def lookup(self, area_id, track_ids, time):
+        """Return cached results of `track_ids` at `time`, or None.
+
+        Returns:
+            list | None: Cached action predictions of each track, or None
+                if the clip has to be evaluated.
+        """
+        with self.lock:
+            self.num_clips += 1
+            preds = []
+            for track_id in track_ids:
+                entry = self.entries.get((area_id, track_id))
+                if (
+                    entry is None
+                    or entry[1] < self.stable_clips
+                    or not 0 <= time - entry[2] < self.interval
+                ):
+                    return None
+                preds.append(entry[0])
+            self.num_hits += 1
+            return preds
+
+    def risk_scores(self, scores, label_names):
+        """Return the score of each bbox that decides whether it is safe.
+
+        Args:
+            scores (ndarray): [num_bboxes, num_labels] action scores.
+            label_names (Sequence[str]): Name of each label column.
+
+        Returns:
+            ndarray: `alert_label` score of each bbox, or its highest action
+                score if the label map has no `alert_label`.
+        """
+        if self.alert_label in list(label_names):
+            return scores[:, list(label_names).index(self.alert_label)]
+        if scores.shape[1] == 0:
+            return np.zeros(scores.shape[0], dtype=scores.dtype)
+        return scores.max(axis=1)
+
+    def update(self, area_id, track_ids, time, preds, risk_scores):
+        """Store evaluated results of a clip.
+
+        Args:
+            area_id (int): Camera of the clip.
+            track_ids (list[int]): Track id of each bbox.
+            time (int): Time step of the clip.
+            preds (list[list[tuple]]): Action predictions of each bbox.
+            risk_scores (list[float]): Score of each bbox compared with
+                `safe_thr`, see `risk_scores`.
+        """
+        with self.lock:
+            for track_id, pred, risk in zip(track_ids, preds, risk_scores):
+                entry = self.entries.get((area_id, track_id))
+                if entry is not None and time < entry[2]:
+                    continue  # newer results are cached already
+                safe = entry[1] + 1 if entry is not None else 1
+                if risk >= self.safe_thr:
+                    safe = 0
+                self.entries[(area_id, track_id)] = [pred, safe, time]
+
+            # forget tracks that have not been seen for a while
+            for key in [
+                key
+                for key, entry in self.entries.items()
+                if key[0] == area_id and time - entry[2] > 4 * self.interval
+            ]:
+                del self.entries[key]